@@ -0,0 +1,60 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Appends to a macro of a unit many times and measures the time it takes
+to append and to evaluate the resulting value. Before appends were
+stored in a flat :class:`creator.macro.AppendNode`, each append nested
+the previous value one level deeper.
+
+    $ python benchmarks/macro_append.py [count]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.unit
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+  workspace = creator.unit.Workspace()
+  unit = creator.unit.Unit(os.getcwd(), 'bench', workspace)
+  unit.define('Flags', '-O2')
+
+  start = time.time()
+  for index in range(count):
+    unit.append('Flags', ' -DVALUE{0}'.format(index))
+  t_append = time.time() - start
+
+  start = time.time()
+  value = unit.eval('$Flags')
+  t_eval = time.time() - start
+
+  assert len(value.split()) == count + 1
+  print('appends:     {0}'.format(count))
+  print('append():    {0:.3f}s'.format(t_append))
+  print('eval():      {0:.3f}s'.format(t_eval))
+
+
+if __name__ == '__main__':
+  main()
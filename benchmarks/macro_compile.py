@@ -0,0 +1,61 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Compares the evaluation time of a parsed macro expression tree with
+the function produced by :meth:`creator.macro.ExpressionNode.compile`,
+simulating the command of a ``Target.build_each()`` call.
+
+    $ python benchmarks/macro_compile.py [count]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.unit
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+
+  context = creator.unit.Workspace().context
+  context['cpp'] = 'g++'
+  context['compileonly'] = '-c'
+  context['objout'] = '-o $(quote $0)'
+  context['include'] = '$(quotesplit $(addprefix -I,$0))'
+  context['Includes'] = 'include;vendor/include;build/gen'
+  context['<'] = 'src/main.cpp'
+  context['@'] = 'build/main.o'
+
+  text = '$cpp $compileonly $(include $Includes) -Wall -O2 $(objout $@) $(quote $<)'
+  macro = creator.macro.parse(text, context)
+  func = macro.compile()
+  assert func(context, []) == macro.eval(context, [])
+
+  t_eval = timeit.timeit(lambda: macro.eval(context, []), number=count)
+  t_comp = timeit.timeit(lambda: func(context, []), number=count)
+  print('evaluations: {0}'.format(count))
+  print('eval():      {0:.3f}s'.format(t_eval))
+  print('compiled:    {0:.3f}s ({1:.2f}x)'.format(t_comp, t_eval / t_comp))
+
+
+if __name__ == '__main__':
+  main()
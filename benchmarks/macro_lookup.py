@@ -0,0 +1,61 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Measures how long it takes to look up macros in the context of a unit
+by name: a macro of the unit, a macro of an aliased unit, a global
+macro, a built-in function and a name that does not exist.
+
+    $ python benchmarks/macro_lookup.py [count]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.unit
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+  workspace = creator.unit.Workspace()
+  compiler = creator.unit.Unit(os.getcwd(), 'compiler', workspace)
+  compiler.define('cc', 'gcc')
+  unit = creator.unit.Unit(os.getcwd(), 'bench', workspace)
+  unit.aliases['c'] = 'compiler'
+  unit.define('BuildDir', 'build')
+  workspace.context['Config'] = 'Release'
+
+  context = unit.context
+  names = ['BuildDir', 'c:cc', 'Config', 'addprefix', 'CREATOR_UNDEFINED']
+  print('lookups:     {0} per name'.format(count))
+  for name in names:
+    def lookup():
+      try:
+        context.get_macro(name)
+      except KeyError:
+        pass
+    t = timeit.timeit(lookup, number=count)
+    print('{0:<18} {1:.3f}s'.format(name + ':', t))
+
+
+if __name__ == '__main__':
+  main()
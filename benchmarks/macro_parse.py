@@ -0,0 +1,109 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Parses all string literals found in a corpus of unit scripts with both
+the :class:`creator.macro.Parser` and the reference implementation
+:class:`creator.macro.ScannerParser`, verifies that both produce the
+same expression trees and compares the time it took. The builtin unit
+scripts are always part of the corpus.
+
+    $ python benchmarks/macro_parse.py [file.crunit ...]
+"""
+
+import ast
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.macro
+
+# Strings that exercise the corner cases of the grammar.
+EDGE_CASES = [
+  '', '$', '$$', '$$$', '\\', '\\$a', 'a\\', '50$ off', '$ a', '$(', '$(a',
+  '$(a,', '$(a b,', '$()', '${', '${a', '${ a }', '${a b}', '$"', '$"a', '$!a',
+  '$*{a}', '$*(a, b)', '$"(a)', '$(a )', '$(a b, c , d)', '$(a ,,b)', '$(a b,)',
+  '$(a $(b c), $d)e', '$a:b$c.d', '$(f a\\,b, c\\)d)', '$(f (a), b)', '${a}}',
+  '$(f $(g $(h x, y)), z', 'a;b\\;c $0 $1', '$(quotesplit $(addprefix -I,$0))',
+  '\n  $a  \n', '$(f\na,\tb)',
+]
+
+
+def dump(node):
+  if type(node) is creator.macro.TextNode:
+    return node.text
+  elif type(node) is creator.macro.ConcatNode:
+    return ('concat', tuple(dump(n) for n in node.nodes))
+  elif type(node) is creator.macro.VarNode:
+    return ('var', node.varname, tuple(dump(n) for n in node.args))
+  raise TypeError(type(node))
+
+
+def load_corpus(filenames):
+  corpus = list(EDGE_CASES)
+  for filename in filenames:
+    with open(filename) as fp:
+      tree = ast.parse(fp.read(), filename)
+    for node in ast.walk(tree):
+      if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        corpus.append(node.value)
+  return corpus
+
+
+def measure(parser, corpus, repeat):
+  start = time.perf_counter()
+  for i in range(repeat):
+    for text in corpus:
+      parser.parse(text, None)
+  return time.perf_counter() - start
+
+
+def main():
+  builtins = os.path.join(os.path.dirname(creator.macro.__file__), 'builtins')
+  filenames = glob.glob(os.path.join(builtins, '*.crunit')) + sys.argv[1:]
+  corpus = load_corpus(filenames)
+
+  # Disable the parse cache, we want to measure the actual parsing.
+  parser = creator.macro.Parser(cache_size=0)
+  reference = creator.macro.ScannerParser(cache_size=0)
+
+  mismatches = 0
+  for text in corpus:
+    if dump(parser.parse(text, None)) != dump(reference.parse(text, None)):
+      print('mismatch: {0!r}'.format(text))
+      mismatches += 1
+
+  # Long command lines are where the two implementations differ the most.
+  flags = ' '.join('-DFEATURE_{0}=1 -Iinclude/dir{0}'.format(i) for i in range(300))
+  long_corpus = [flags + ' $(quote $<) $(quote $@)'] * 10
+
+  print('files: {0}, strings: {1}, mismatches: {2}'.format(
+    len(filenames), len(corpus), mismatches))
+  for name, texts, repeat in [('corpus', corpus, 50), ('long', long_corpus, 20)]:
+    t_ref = measure(reference, texts, repeat)
+    t_new = measure(parser, texts, repeat)
+    print('{0:>7}: ScannerParser {1:.3f}s, Parser {2:.3f}s ({3:.1f}x)'.format(
+      name, t_ref, t_new, t_ref / t_new))
+  return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
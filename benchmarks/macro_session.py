@@ -0,0 +1,74 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Evaluates a command that references the same variables many times,
+like the commands of ``Target.build_each()``, with and without a
+:class:`creator.macro.EvalSession` that caches the variable values.
+Values of macros that did not change are reused from the previous
+session.
+
+    $ python benchmarks/macro_session.py [count]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.unit
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+  context = creator.unit.Workspace().context
+  context['BuildDir'] = '$ProjectPath/build/$Config'
+  context['ProjectPath'] = '/home/user/project'
+  context['Config'] = '$(lower Release)'
+  context['Includes'] = '$BuildDir/gen;$ProjectPath/include;$ProjectPath/vendor'
+  context['Defines'] = 'NDEBUG;VERSION=1;OUTDIR=$BuildDir'
+  context['<'] = 'src/main.c'
+  context['@'] = '$BuildDir/obj/main.o'
+
+  text = ('gcc -c $(addprefix -I,$Includes) $(addprefix -D,$Defines) '
+    '-MMD -MF $@.d -o $@ $< -L$BuildDir/lib -Wl,-rpath,$BuildDir/lib')
+  macro = creator.macro.parse(text, context)
+
+  def with_session():
+    with creator.macro.EvalSession() as session:
+      return macro.eval(context, []), session
+
+  value, session = with_session()
+  assert value == macro.eval(context, [])
+  value, session = with_session()
+  assert value == macro.eval(context, [])
+
+  t_plain = timeit.timeit(lambda: macro.eval(context, []), number=count)
+  t_session = timeit.timeit(with_session, number=count)
+  print('evaluations: {0}'.format(count))
+  print('cache hits:  {0} of {1} per evaluation'.format(
+    session.hits, session.hits + session.misses))
+  print('reused:      {0} macro values per evaluation'.format(session.macro_hits))
+  print('eval():      {0:.3f}s'.format(t_plain))
+  print('session:     {0:.3f}s ({1:.2f}x)'.format(t_session, t_plain / t_session))
+
+
+if __name__ == '__main__':
+  main()
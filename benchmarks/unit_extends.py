@@ -0,0 +1,67 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Measures the time and memory it takes for many units to extend the
+same base unit with :meth:`creator.unit.Unit.extends`.
+
+    $ python benchmarks/unit_extends.py [count]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.unit
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+  workspace = creator.unit.Workspace()
+  base = creator.unit.Unit(os.getcwd(), 'base', workspace)
+  workspace.units['base'] = base
+  for i in range(50):
+    base.define('Flags{0}'.format(i),
+      '$(addprefix -I,$IncludeDirs) -DINDEX={0} $(quote $ProjectPath/src) $Flags{1}'
+      .format(i, max(i - 1, 0)))
+
+  tracemalloc.start()
+  start = time.perf_counter()
+  units = []
+  for i in range(count):
+    name = 'unit{0}'.format(i)
+    unit = creator.unit.Unit(os.getcwd(), name, workspace)
+    unit.extends('base')
+    unit.define('IncludeDirs', name)
+    units.append(unit)
+  elapsed = time.perf_counter() - start
+  memory = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+
+  assert units[-1].eval('$Flags1') != base.eval('$Flags1')
+  print('units:      {0}'.format(count))
+  print('extends():  {0:.3f}s'.format(elapsed))
+  print('memory:     {0:.1f} MiB'.format(memory / 2**20))
+
+
+if __name__ == '__main__':
+  main()
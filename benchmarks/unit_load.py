@@ -0,0 +1,98 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Measures loading a workspace of generated unit scripts with an empty
+and a populated bytecode cache (see
+:func:`creator.unit.compile_unit_script`).
+
+    $ python benchmarks/unit_load.py [count]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.unit
+
+UNIT_TEMPLATE = '''
+load('platform', 'p')
+load('compiler', 'c')
+define('Sources', '$(wildcard $ProjectPath/src/*.cpp)')
+define('Objects', '$(p:obj $(move $Sources, $ProjectPath/src, $ProjectPath/build))')
+define('Program', '$(p:bin $ProjectPath/build/{name})')
+define('Flags', '-O2 -g -Wall -DUNIT_{name}=1')
+
+def configure(flags):
+  if eq('$Platform', 'Windows'):
+    return flags + ' -DWIN32'
+  return flags
+
+@target
+def objects():
+  objects.build_each('$Sources', '$Objects',
+    '$c:cpp $Flags $c:compileonly $(c:objout $@) $(quote $<)')
+
+@target
+def program():
+  program.requires('objects')
+  program.build('$Objects', '$Program', '$c:cpp $(c:binout $@) $(quotesplit $<)')
+
+@task
+def run():
+  shell('$(quote $Program)')
+'''
+
+
+def load(root, count):
+  start = time.perf_counter()
+  workspace = creator.unit.Workspace()
+  workspace.path.insert(0, root)
+  for i in range(count):
+    workspace.load_unit('unit{0:04d}'.format(i))
+  return time.perf_counter() - start
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+  sys.dont_write_bytecode = False
+  root = tempfile.mkdtemp()
+  try:
+    os.environ['CREATOR_CACHE_DIR'] = os.path.join(root, 'cache')
+    for i in range(count):
+      name = 'unit{0:04d}'.format(i)
+      os.makedirs(os.path.join(root, name))
+      with open(os.path.join(root, name, name + '.crunit'), 'w') as fp:
+        fp.write(UNIT_TEMPLATE.format(name=name))
+      os.utime(os.path.join(root, name, name + '.crunit'), (0, 0))
+
+    cold = load(root, count)
+    warm = min(load(root, count) for i in range(3))
+    print('units:      {0}'.format(count))
+    print('cold cache: {0:.3f}s'.format(cold))
+    print('warm cache: {0:.3f}s ({1:.2f}x)'.format(warm, cold / warm))
+  finally:
+    shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+  main()
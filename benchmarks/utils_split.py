@@ -0,0 +1,63 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+"""
+Measures :func:`creator.utils.split`, :func:`creator.utils.iter_split`
+and :func:`creator.utils.join` on lists of 10k, 100k and 1M file names,
+with and without escaped semicolons.
+
+    $ python benchmarks/utils_split.py
+"""
+
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.utils
+
+
+def measure(func, *args):
+  start = time.perf_counter()
+  func(*args)
+  return time.perf_counter() - start
+
+
+def main():
+  for count in (10000, 100000, 1000000):
+    for escaped in (False, True):
+      items = ['/home/user/project/src/module{0}/file{0}.cpp'.format(i)
+        for i in range(count)]
+      if escaped:
+        items[count // 2] += ';'
+      text = creator.utils.join(items)
+      assert creator.utils.split(text) == items
+      assert list(creator.utils.iter_split(text)) == items
+
+      t_join = measure(creator.utils.join, items)
+      t_split = measure(creator.utils.split, text)
+      t_iter = measure(collections.deque, creator.utils.iter_split(text), 0)
+      print('{0:>8} items, {1:>6.1f} MB{2}: join {3:.3f}s, split {4:.3f}s, '
+        'iter_split {5:.3f}s'.format(count, len(text) / 1e6,
+        ' (escaped)' if escaped else '          ', t_join, t_split, t_iter))
+
+
+if __name__ == '__main__':
+  main()
@@ -33,7 +33,9 @@ if sys.version_info[0] != 3:
   raise EnvironmentError('Creator {0} requires Python 3'.format(__version__))
 
 import creator.macro
+import creator.manifest
 import creator.ninja
 import creator.platform
+import creator.snapshot
 import creator.unit
 import creator.utils
@@ -18,6 +18,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import creator.manifest
+import creator.scheduler
+import creator.snapshot
 import creator.unit
 import creator.utils
 import creator.ninja
@@ -40,6 +43,10 @@ parser.add_argument('-D', '--define', help='Define a global variable that '
 parser.add_argument('-M', '--macro', help='The same as -D/--define but '
   ' evaluates like a macro. Remember that backslashes must be escaped, etc.',
   default=[], action='append')
+parser.add_argument('--pool', help='Set the depth of a ninja pool in '
+  'the form NAME=DEPTH. The same as defining the <pool.NAME> variable. '
+  'The depths of the <link> and <heavy> pools default to the number of '
+  'CPUs, limited by the available memory.', default=[], action='append')
 parser.add_argument('-i', '--unitpath', help='Add an additional path to '
   'search for unit scripts to the workspace. The environment variable '
   'CREATORPATH is taken into account automatically as the search path '
@@ -50,8 +57,9 @@ parser.add_argument('-u', '--unit', help='The identifier of the unit to '
   'determined from the files in the current directory. There must only be '
   'one unit in the current directory if the automatic detection is used.')
 parser.add_argument('targets', metavar='target', nargs='*', help='One or '
-  'more full or local target or task identifiers to execute. Ninja will be '
-  'invoked separately for each specified target.')
+  'more full or local target or task identifiers to execute. Consecutive '
+  'targets are built with a single invokation of ninja, tasks are run in '
+  'between in the specified order.')
 parser.add_argument('-e', '--export', help='Export the build.ninja file '
   'only. The specified targets will be the default targets in the file. '
   'A warning will be printed if any non-targets (ie. tasks) are specified.',
@@ -68,11 +76,55 @@ parser.add_argument('-c', '--clean', help='Adds the `-t clean` options '
   'to the ninja invokation.', action='store_true')
 parser.add_argument('-v', '--verbose', help='Adds the `-v` option to '
   'the inja invokation.', action='store_true')
+parser.add_argument('-s', '--subninja', help='Export the build '
+  'definitions of every unit to a separate file in the <OUTPUT>.d/ '
+  'directory which is included by the output file with `subninja`. The '
+  'files are only rewritten if their content changed.', action='store_true')
+parser.add_argument('--compdb', help='Write a compilation database '
+  'with the commands that compile a single C, C++ or Objective-C source '
+  'file to the specified file, usually <compile_commands.json>, when the '
+  'build definitions are exported. With -s/--subninja, the entries of '
+  'every unit are also kept in the <COMPDB>.d/ directory. The files are '
+  'only rewritten if their content changed.')
+parser.add_argument('-r', '--regenerate', help='Always run the unit '
+  'scripts and export the build definitions. By default, this is skipped '
+  'if none of the unit scripts, options, consulted environment variables '
+  'and directories listed by $(wildcard ...) changed since the last export. '
+  'Tasks are then run from a snapshot of the workspace and the unit scripts '
+  'are only executed again to re-link Python functions that are used.',
+  action='store_true')
+parser.add_argument('--index-cache', help='The file that the directory '
+  'listings scanned by $(wildcard ...) are saved to. Directories that did '
+  'not change since the last invokation are not scanned again. The '
+  'listings of the unit search path are saved to <unitindex.json> in the '
+  'same directory. Pass an empty string to disable. Defaults to '
+  '<.creator/dirindex.json>.',
+  default=os.path.join('.creator', 'dirindex.json'))
+parser.add_argument('--serial', help='Invoke ninja separately for each '
+  'specified target instead of building consecutive targets at once.',
+  action='store_true')
+parser.add_argument('-p', '--parallel', help='Run the specified tasks '
+  'in a pool of threads while ninja builds the targets. Only the '
+  'dependencies of the tasks define the order in which they are run. The '
+  'time taken by each task and ninja invokation is printed at the end.',
+  action='store_true')
+parser.add_argument('--task-jobs', help='The number of tasks to run '
+  'concurrently with -p/--parallel. Defaults to the number of CPUs.',
+  type=int, default=os.cpu_count() or 1)
 parser.add_argument('-a', '--args', help='Additional arguments for all '
   'invokations of <ninja> done by Creator.', nargs=argparse.REMAINDER,
   default=[])
 
 
+#: The file that records the inputs of the last export of the build
+#: definitions, see :class:`creator.manifest.Manifest`.
+MANIFEST_FILE = os.path.join('.creator', 'manifest.json')
+
+#: The file that the workspace is saved to along with the manifest, see
+#: :mod:`creator.snapshot`.
+SNAPSHOT_FILE = os.path.join('.creator', 'snapshot.pickle')
+
+
 def log(*args, **kwargs):
   kwargs.setdefault('fg', 'cyan')
   term_print('creator:', *args, **kwargs)
@@ -92,9 +144,73 @@ def main(argv=None):
     parser.error('conflicting options -n/--no-export and -e/--export')
   if args.dry and args.export:
     parser.error('conflicting options -d/--dry and -e/--export')
+  if args.parallel and args.serial:
+    parser.error('conflicting options -p/--parallel and --serial')
+
+  # If not Unit Identifier was specified on the command-line,
+  # look at the current directory and use the only .crunit that
+  # is in there.
+  if not args.unit:
+    files = glob.glob('*.crunit')
+    if not files:
+      parser.error('no *.crunit file in the current directory')
+    elif len(files) > 1:
+      parser.error('multiple *.crunit files in the current '
+        'directory, use -u/--unit to specify which.')
+    args.unit = creator.utils.set_suffix(os.path.basename(files[0]), '')
+
+  # The options that, besides the files and environment, have an
+  # effect on the exported build definitions. The unit search path
+  # decides which unit scripts are found.
+  path = creator.unit.Workspace.default_path() + args.unitpath
+  options = {'define': args.define, 'macro': args.macro,
+    'pool': args.pool, 'path': path, 'unit': args.unit,
+    'output': args.output, 'subninja': args.subninja, 'compdb': args.compdb}
+
+  # Skip running the unit scripts entirely if the build definitions
+  # from the last invokation are still up to date.
+  if not args.dry and not args.regenerate:
+    manifest = creator.manifest.Manifest.load(MANIFEST_FILE)
+    resolved = resolve_targets(manifest, args.unit, args.targets)
+    if resolved is not None:
+      idents = [ident for ident, kind in resolved if kind == 'target']
+      has_tasks = len(idents) != len(resolved)
+      # Running only tasks does not export the build definitions, thus
+      # the default targets of the last export are fine.
+      if has_tasks and not idents and not args.export:
+        options['defaults'] = manifest.options.get('defaults')
+      else:
+        options['defaults'] = idents
+      if manifest.is_up_to_date(options):
+        if args.export:
+          log("build definitions are up to date: {0}".format(manifest.output))
+          return 0
+        if not has_tasks:
+          log("build definitions are up to date: {0}".format(manifest.output))
+          return run_ninja(args, manifest.output, idents)
+        workspace = creator.snapshot.load(SNAPSHOT_FILE, manifest.fingerprint())
+        if workspace is not None:
+          log("build definitions are up to date: {0}".format(manifest.output))
+          unit = workspace.get_unit(args.unit)
+          targets = [unit.get_target(x) for x in args.targets]
+          return run_ninja(args, manifest.output, targets)
+
+  # Create the directory of the manifest up-front, otherwise it would
+  # show up as a change in the directory listings that it records.
+  dirname = os.path.dirname(MANIFEST_FILE)
+  if not args.dry and not os.path.isdir(dirname):
+    os.makedirs(dirname)
+
+  if args.index_cache:
+    creator.utils.dir_index.filename = args.index_cache
+    creator.utils.dir_index.load()
 
   workspace = creator.unit.Workspace()
   workspace.path.extend(args.unitpath)
+  if args.index_cache:
+    dirname = os.path.dirname(args.index_cache)
+    workspace.unit_index.filename = os.path.join(dirname, 'unitindex.json')
+    workspace.unit_index.load()
 
   # Evaluate the Defines and Macros passed via the command line.
   for define in args.define:
@@ -107,21 +223,17 @@ def main(argv=None):
     if key:
       workspace.context[key] = value
 
-  # If not Unit Identifier was specified on the command-line,
-  # look at the current directory and use the only .crunit that
-  # is in there.
-  if not args.unit:
-    files = glob.glob('*.crunit')
-    if not files:
-      parser.error('no *.crunit file in the current directory')
-    elif len(files) > 1:
-      parser.error('multiple *.crunit files in the current '
-        'directory, use -u/--unit to specify which.')
-    args.unit = creator.utils.set_suffix(os.path.basename(files[0]), '')
+  for pool in args.pool:
+    name, _, depth = pool.partition('=')
+    if not name or not depth.isdigit():
+      parser.error('invalid --pool {0!r}, expected NAME=DEPTH'.format(pool))
+    workspace.context['pool.' + name] = creator.macro.TextNode(depth)
 
   # Load the active unit and set up all targets.
   unit = workspace.load_unit(args.unit)
   workspace.setup_targets()
+  creator.utils.dir_index.save()
+  workspace.unit_index.save()
 
   # Exit if this is just a dry run.
   if args.dry:
@@ -152,13 +264,131 @@ def main(argv=None):
   # If we have any buildable targets specified, no targets specified at
   # all or if we should only export the build definitions, do exactly that.
   if not args.no_export and (args.export or defaults or not targets):
+    options['defaults'] = defaults
+    manifest = creator.manifest.Manifest.from_workspace(
+      workspace, options, args.output)
+    # The generator rule depends on the files and directories recorded
+    # in the manifest, except for the unit search path. Ninja writes its
+    # log to the current directory, which would always leave it newer
+    # than the build definitions, thus that directory and the one that
+    # contains the build definitions are left out as well. So are the
+    # directories the build writes its outputs to.
+    normpath = creator.utils.normpath
+    exclude = set(map(normpath, workspace.path))
+    exclude.add(normpath(os.curdir))
+    exclude.add(os.path.dirname(normpath(args.output)))
+    exclude.update(output_dirs(workspace))
+    inputs = [x for x in manifest.inputs() if normpath(x) not in exclude]
+    generator = (args.output, generator_command(args, options), inputs)
+    subninja_dir = args.output + '.d' if args.subninja else None
     log("exporting to: {0}".format(args.output))
     with open(args.output, 'w') as fp:
-      creator.ninja.export(fp, workspace, unit, defaults)
+      creator.ninja.export(fp, workspace, unit, defaults, generator,
+        subninja_dir, args.compdb)
+    manifest.save(MANIFEST_FILE)
+    creator.snapshot.save(SNAPSHOT_FILE, workspace, manifest.fingerprint())
     if args.export:
       return 0
 
-  ninja_args = ['ninja', '-f', args.output] + args.args
+  return run_ninja(args, args.output, targets)
+
+
+def output_dirs(workspace):
+  """
+  Returns:
+    set of str: The normalized directories of the files that the
+    targets of all units in *workspace* write, ie. their outputs,
+    depfiles and response files.
+  """
+
+  result = set()
+  for unit in workspace.units.values():
+    for target in unit.targets.values():
+      if not isinstance(target, creator.unit.Target):
+        continue
+      for entry in target.command_data:
+        files = list(entry['outputs'])
+        files.extend(filter(None, [entry['depfile'], entry['rspfile']]))
+        for filename in files:
+          result.add(os.path.dirname(creator.utils.normpath(filename)))
+  return result
+
+
+def generator_command(args, options):
+  """
+  Returns:
+    str: The shell command that invokes *Creator* from the current
+    directory to export the build definitions again with the same
+    *options*, thus the manifest it saves matches the *options* of
+    later invocations with the same command-line.
+  """
+
+  command = [sys.executable, '-m', 'creator', '-e', '-r', '-u', args.unit]
+  if options['output']:
+    command.extend(['-o', options['output']])
+  command.extend('-D' + x for x in args.define)
+  command.extend('-M' + x for x in args.macro)
+  command.extend('--pool=' + x for x in args.pool)
+  command.extend('-i' + x for x in args.unitpath)
+  if args.subninja:
+    command.append('-s')
+  if args.compdb:
+    command.append('--compdb=' + args.compdb)
+  if args.index_cache != parser.get_default('index_cache'):
+    command.append('--index-cache=' + args.index_cache)
+  command.extend(options['defaults'])
+
+  quote = creator.utils.quote
+  command = ' '.join(map(quote, command))
+  cwd = quote(os.getcwd())
+  if os.name == 'nt':
+    return 'cmd /c cd /d {0} && {1}'.format(cwd, command)
+  return 'cd {0} && {1}'.format(cwd, command)
+
+
+def resolve_targets(manifest, unit, names):
+  """
+  Resolves the target *names* specified on the command-line relative
+  to the *unit* using the targets recorded in the *manifest*.
+
+  Returns:
+    list of (str, str): The full identifiers of the targets paired with
+    either ``'target'`` or ``'task'``, or None if the *manifest* is None
+    or if any of the names is unknown.
+  """
+
+  if manifest is None:
+    return None
+  idents = []
+  for name in names:
+    namespace, varname = creator.utils.parse_var(name)
+    if namespace is None:
+      namespace = unit
+    ident = creator.utils.create_var(namespace, varname)
+    kind = manifest.targets.get(ident)
+    if kind is None:
+      return None
+    idents.append((ident, kind))
+  return idents
+
+
+def run_ninja(args, filename, targets):
+  """
+  Invokes ninja on the build definitions in *filename* for the *targets*
+  and runs the tasks in between. Consecutive targets are passed to the
+  same invokation of ninja unless ``--serial`` is specified, thus tasks
+  act as barriers between the builds. The dependencies of the tasks are
+  built and run before them. With ``--parallel``, the
+  :class:`creator.scheduler.Scheduler` is used instead. The *targets*
+  may also be full target identifiers.
+  """
+
+  # Ninja and the tasks create files, thus directory listings can no
+  # longer be cached for $(wildcard ...) from here on.
+  creator.utils.dir_index.clear()
+  creator.utils.dir_index.enabled = False
+
+  ninja_args = ['ninja', '-f', filename] + args.args
   if args.clean:
     ninja_args.extend(['-t', 'clean'])
   if args.verbose:
@@ -167,17 +397,38 @@ def main(argv=None):
   # No targets specified on the command-line? Build it all.
   if not targets:
     return call_subprocess(ninja_args)
+  elif args.parallel:
+    scheduler = creator.scheduler.Scheduler(ninja_args, args.task_jobs, log)
+    results = scheduler.run(targets)
+    for result in results:
+      status = 'ok' if result.returncode == 0 else 'failed'
+      log("{0:>8.2f}s {1} {2} ({3})".format(result.duration, result.kind,
+        result.name, status))
+    for result in results:
+      if result.returncode != 0:
+        return result.returncode
+    return 0
   else:
-    # Run each target with its own call to ninja and the tasks in between.
-    for target in targets:
+    targets = creator.scheduler.expand(targets)
+    # Collect the targets up to the next task and build them with one
+    # call to ninja, then run the task.
+    idents = []
+    for target in targets + [None]:
+      barrier = not isinstance(target, (str, creator.unit.Target))
+      if idents and (barrier or args.serial):
+        res = call_subprocess(ninja_args + idents)
+        if res != 0:
+          return res
+        idents = []
       if isinstance(target, creator.unit.Task):
         log("running task '{0}'".format(target.identifier))
         target.func()
-      elif isinstance(target, creator.unit.Target):
-        ident = creator.ninja.ident(target.identifier)
-        res = call_subprocess(ninja_args + [ident])
-        if res != 0:
-          return res
+      elif target is not None:
+        if isinstance(target, creator.unit.Target):
+          target = target.identifier
+        ident = creator.ninja.ident(target)
+        if ident not in idents:
+          idents.append(ident)
 
     return 0
 
@@ -20,10 +20,13 @@
 
 import creator.utils
 import abc
+import collections
 import glob
 import os
+import re
 import string
 import sys
+import threading
 import weakref
 
 
@@ -84,17 +87,25 @@ class MutableContext(ContextProvider):
   string is set with ``__setitem__()``, it will automatically be parsed
   into an expression tree.
 
+  Every change of a macro increments its version, which allows the
+  values of macros that have been evaluated in an :class:`EvalSession`
+  to be reused as long as none of the macros they read changed.
+
   Attributes:
     macros (dict of str -> ExpressionNode): The internal dictionary
       mapping the macro names with the actual macro objects.
+    versions (dict of str -> int): The number of times each macro has
+      been changed. Macros that were never set have version 0.
   """
 
   def __init__(self):
     super().__init__()
     self.macros = {}
+    self.versions = {}
 
   def __getitem__(self, name):
-    return self.get_macro(name).eval(self, [])
+    with EvalSession.enter() as session:
+      return to_str(session.eval_macro(self.get_macro(name), self))
 
   def __setitem__(self, name, value):
     if isinstance(value, str):
@@ -109,12 +120,46 @@ class MutableContext(ContextProvider):
     for ref_name in self.get_aliases(name):
       value = value.substitute(ref_name, old_value)
     self.macros[name] = value
+    self.changed(name)
 
   def __delitem__(self, name):
     try:
       del self.macros[name]
     except KeyError:
       pass
+    else:
+      self.changed(name)
+
+  def append(self, name, value):
+    """
+    Appends *value* to the macro *name*. This has the same result as
+    setting the macro to ``'${name}' + value``, but the nodes are kept
+    in an :class:`AppendNode`, thus it takes constant time and the
+    evaluation takes linear time in the number of appended values.
+    References to the macro in *value* expand to its previous value.
+    """
+
+    if isinstance(value, str):
+      value = parse_appendix(value, self)
+    elif not isinstance(value, ExpressionNode):
+      message = 'value must be str or ExpressionNode'
+      raise TypeError(message, type(value))
+    old_value = self.macros.get(name) or TextNode('')
+    for ref_name in self.get_aliases(name):
+      value = value.substitute(ref_name, old_value)
+    if isinstance(old_value, AppendNode):
+      self.macros[name] = old_value.append(value)
+    else:
+      self.macros[name] = AppendNode([old_value, value])
+    self.changed(name)
+
+  def changed(self, name):
+    """
+    Increments the version of the macro *name*. Must be called when
+    :attr:`macros` is modified directly.
+    """
+
+    self.versions[name] = self.versions.get(name, 0) + 1
 
   def get_aliases(self, name):
     """
@@ -137,12 +182,16 @@ class MutableContext(ContextProvider):
     """
 
     self.macros[func.__name__] = Function(func)
+    self.changed(func.__name__)
     return self.macros[func.__name__]
 
   def has_macro(self, name):
     return name in self.macros
 
   def get_macro(self, name, default=NotImplemented):
+    session = EvalSession._local.current
+    if session is not None and session.depth:
+      session.reads.append((self, name, self.versions.get(name, 0)))
     if name in self.macros:
       return self.macros[name]
     elif default is not NotImplemented:
@@ -231,6 +280,8 @@ class StackFrameContext(ContextProvider):
 
     if isinstance(value, str):
       value = creator.macro.TextNode(str(value))
+    elif isinstance(value, (list, tuple)) and all(isinstance(x, str) for x in value):
+      value = creator.macro.ListNode(value)
     if not isinstance(value, creator.macro.ExpressionNode):
       raise KeyError(name)
 
@@ -240,10 +291,117 @@ class StackFrameContext(ContextProvider):
     raise KeyError(name)
 
 
+class SwitchedContext(ContextProvider):
+  """
+  The context that a :class:`ContextSwitchNode` passes to the nodes of
+  the tree it shares. Variables in the tree are resolved in *context*,
+  no matter which context they are bound to.
+  """
+
+  def __init__(self, context):
+    super().__init__()
+    self.context = context
+
+  def has_macro(self, name):
+    return self.context.has_macro(name)
+
+  def get_macro(self, name, default=NotImplemented):
+    return self.context.get_macro(name, default)
+
+  def get_namespace(self):
+    return self.context.get_namespace()
+
+
+def to_str(value):
+  """
+  Converts the result of :meth:`ExpressionNode.eval_value` to a string.
+  Lists are joined with :func:`creator.utils.join`.
+  """
+
+  if isinstance(value, str):
+    return value
+  return creator.utils.join(value)
+
+
+def to_list(value):
+  """
+  Converts the result of :meth:`ExpressionNode.eval_value` to a list.
+  Strings are split with :func:`creator.utils.split`. The returned list
+  must not be modified as it may be the list of a :class:`ListNode`.
+  """
+
+  if isinstance(value, str):
+    return creator.utils.split(value)
+  if all(value):
+    return value
+  return [x for x in value if x]
+
+
+def strip(value):
+  """
+  Strips leading and trailing whitespace from the result of
+  :meth:`ExpressionNode.eval_value`. For lists, this has the same
+  effect as stripping the joined string.
+  """
+
+  if isinstance(value, str):
+    return value.strip()
+  if not value:
+    return value
+  first, last = value[0].lstrip(), value[-1].rstrip()
+  if first is value[0] and last is value[-1]:
+    return value
+  if len(value) == 1:
+    first = first.rstrip()
+    return [first] if first else []
+  return ([first] if first else []) + value[1:-1] + ([last] if last else [])
+
+
+def eval_list(context, nodes, strip_items=False):
+  """
+  Evaluates all *nodes* with :meth:`ExpressionNode.eval_value` and
+  concatenates the results into a single list.
+
+  Args:
+    context (ContextProvider): The context to evaluate with.
+    nodes (list of ExpressionNode): The nodes to evaluate.
+    strip_items (bool): True if the result of each node should be
+      passed to :func:`strip`.
+  Returns:
+    list of str: The concatenated list.
+  """
+
+  result = []
+  for node in nodes:
+    value = node.eval_value(context, [])
+    if strip_items:
+      value = strip(value)
+    if len(nodes) == 1:
+      return to_list(value)
+    result.extend(to_list(value))
+  return result
+
+
+def value_node(value):
+  """
+  Wraps the result of :meth:`ExpressionNode.eval_value` in a
+  :class:`TextNode` or :class:`ListNode`.
+  """
+
+  if isinstance(value, str):
+    return TextNode(value)
+  return ListNode(value)
+
+
 class ExpressionNode(object, metaclass=abc.ABCMeta):
   """
   Base class for macro expression nodes that can be evaluated with
   a :class:`ContextProvider` and rendered to a string.
+
+  Lists are represented as semicolon separated strings (see
+  :func:`creator.utils.split`). To avoid converting them back and forth
+  between macro functions, nodes can also produce a Python list of
+  strings with :meth:`eval_value`.
   """
 
   @abc.abstractmethod
@@ -262,6 +420,20 @@ class ExpressionNode(object, metaclass=abc.ABCMeta):
 
     raise NotImplementedError
 
+  def eval_value(self, context, args):
+    """
+    Like :meth:`eval`, but the node may return a list of strings
+    instead of a semicolon separated string if that is its natural
+    result. Empty strings in the list are ignored. Use :func:`to_str`
+    and :func:`to_list` to convert the result. The default
+    implementation returns the result of :meth:`eval`.
+
+    Returns:
+      str or list of str: The evaluated macro.
+    """
+
+    return self.eval(context, args)
+
   @abc.abstractmethod
   def substitute(self, ref_name, node):
     """
@@ -269,12 +441,16 @@ class ExpressionNode(object, metaclass=abc.ABCMeta):
     name like the :meth:`VarNode` and must replace any occurence that
     expands the reference named by *ref_name* with *node*.
 
+    Expression trees may be shared (eg. by the :class:`Parser` cache),
+    thus nodes must not be modified in place. If anything needs to be
+    substituted, a new node must be returned instead.
+
     Args:
       ref_name (str): The name of the variable. May contain a double
         colon ``:`` to separate namespace and variable name.
       node (ExpressionNode): The node to insert in place.
     Returns:
-      ExpressionNode: *self* or *node*.
+      ExpressionNode: *self*, *node* or a new node.
     """
 
     return self
@@ -294,6 +470,91 @@ class ExpressionNode(object, metaclass=abc.ABCMeta):
 
     raise NotImplementedError
 
+  def compile(self):
+    """
+    Lowers the expression node into a Python function that accepts the
+    same arguments as :meth:`eval` and returns the same result. The
+    default implementation returns the bound :meth:`eval` method, nodes
+    that can do better override this method.
+
+    Note that the compiled function reflects the node at the time it
+    was compiled. Changes to the node afterwards are not taken into
+    account by the function.
+
+    Returns:
+      callable: A function ``func(context, args) -> str``.
+    """
+
+    return self.eval
+
+  def compile_value(self):
+    """
+    Like :meth:`compile`, but the returned function behaves like
+    :meth:`eval_value`.
+    """
+
+    return self.eval_value
+
+  def __getstate__(self):
+    # The value stored by EvalSession.eval_macro() references the
+    # contexts it has been evaluated in, it is not pickled. Neither
+    # are the names cached by varnames().
+    state = self.__dict__.copy()
+    state.pop('_stored_value', None)
+    state.pop('_varnames', None)
+    state.pop('_compiled_value', None)
+    return state
+
+
+def compiled_value(node):
+  """
+  Returns the function of :meth:`ExpressionNode.compile_value` for
+  *node*. The function is cached with the node, thus a macro is only
+  compiled the first time a compiled expression expands it. The
+  Python function of subclasses of :class:`Function` (eg. functions
+  that are re-linked lazily) is not resolved here, their
+  :meth:`Function.eval_value` is returned instead.
+
+  Args:
+    node (ExpressionNode): A node that is no longer modified.
+  Returns:
+    callable: A function ``func(context, args) -> str or list of str``.
+  """
+
+  try:
+    return node.__dict__['_compiled_value']
+  except KeyError:
+    pass
+  if type(node) is not Function and isinstance(node, Function):
+    return node.eval_value
+  func = node._compiled_value = node.compile_value()
+  return func
+
+
+def const_text(node):
+  """
+  Returns the text that the expression *node* evaluates to if it does
+  not depend on the context or arguments, otherwise None. This is used
+  for constant folding when compiling expression trees.
+
+  Args:
+    node (ExpressionNode): The node to check.
+  Returns:
+    str or None: The constant text of the node or None.
+  """
+
+  if type(node) is TextNode:
+    return node.text
+  elif type(node) is ConcatNode:
+    parts = []
+    for child in node.nodes:
+      text = const_text(child)
+      if text is None:
+        return None
+      parts.append(text)
+    return ''.join(parts)
+  return None
+
 
 class TextNode(ExpressionNode):
   """
@@ -319,6 +580,47 @@ class TextNode(ExpressionNode):
   def copy(self, new_context):
     return TextNode(self.text)
 
+  def compile(self):
+    text = self.text
+    return lambda context, args: text
+
+  compile_value = compile
+
+
+class ListNode(ExpressionNode):
+  """
+  This node evaluates into a list of strings. It is used to pass lists
+  between macro functions without joining and splitting them.
+
+  Attributes:
+    items (list of str): The items of the list.
+  """
+
+  def __init__(self, items):
+    super().__init__()
+    if not isinstance(items, list) or not all(items):
+      items = [x for x in items if x]
+    self.items = items
+    self._text = None
+
+  def eval(self, context, args):
+    if self._text is None:
+      self._text = creator.utils.join(self.items)
+    return self._text
+
+  def eval_value(self, context, args):
+    return self.items
+
+  def substitute(self, ref_name, node):
+    return self
+
+  def copy(self, new_context):
+    return ListNode(self.items)
+
+  def compile_value(self):
+    items = self.items
+    return lambda context, args: items
+
 
 class ConcatNode(ExpressionNode):
   """
@@ -348,98 +650,394 @@ class ConcatNode(ExpressionNode):
       text = node.text
     elif isinstance(node, str):
       text = node
-      node = None
     else:
       text = None
 
+    # Never modify or store a TextNode that was passed in as it
+    # could be shared with another expression tree.
     if text is not None:
-      if self.nodes and isinstance(self.nodes[-1], TextNode):
-        self.nodes[-1].text += text
+      if self.nodes and type(self.nodes[-1]) is TextNode:
+        self.nodes[-1] = TextNode(self.nodes[-1].text + text)
         return
-      if node is None:
-        node = TextNode(text)
+      node = TextNode(text)
 
     self.nodes.append(node)
 
   def eval(self, context, args):
     return ''.join(n.eval(context, args) for n in self.nodes)
 
+  def eval_value(self, context, args):
+    if len(self.nodes) == 1:
+      return self.nodes[0].eval_value(context, args)
+    return self.eval(context, args)
+
   def substitute(self, ref_name, node):
-    for i in range(len(self.nodes)):
-      self.nodes[i] = self.nodes[i].substitute(ref_name, node)
-    return self
+    nodes = [n.substitute(ref_name, node) for n in self.nodes]
+    if all(a is b for a, b in zip(nodes, self.nodes)):
+      return self
+    return ConcatNode(nodes)
 
   def copy(self, new_context):
     nodes = [n.copy(new_context) for n in self.nodes]
     return ConcatNode(nodes)
 
+  def compile(self):
+    text = const_text(self)
+    if text is not None:
+      return lambda context, args: text
+
+    # Merge adjacent constant nodes into a single chunk of text.
+    parts = []
+    for node in self.nodes:
+      text = const_text(node)
+      if text is None:
+        parts.append(node.compile())
+      elif parts and isinstance(parts[-1], str):
+        parts[-1] += text
+      else:
+        parts.append(text)
+
+    if len(parts) == 1:
+      return parts[0]
+    funcs = [(lambda c, a, t=p: t) if isinstance(p, str) else p for p in parts]
+    return lambda context, args: ''.join([f(context, args) for f in funcs])
+
+  def compile_value(self):
+    if len(self.nodes) == 1:
+      return self.nodes[0].compile_value()
+    return self.compile()
+
+
+class AppendNode(ExpressionNode):
+  """
+  The node that :meth:`MutableContext.append` stores for a macro. It
+  concatenates its nodes on evaluation like a :class:`ConcatNode`, but
+  :meth:`append` returns a new node instead of modifying this one. The
+  new node shares the list of nodes with this one unless another node
+  has already been appended to it, thus appending to a macro repeatedly
+  takes constant time and the expression tree stays flat.
+
+  Attributes:
+    nodes (list of ExpressionNode): The nodes of this node. Read-only.
+  """
+
+  def __init__(self, nodes, count=None):
+    super().__init__()
+    self._nodes = nodes
+    self._count = len(nodes) if count is None else count
+
+  @property
+  def nodes(self):
+    if self._count == len(self._nodes):
+      return self._nodes
+    return self._nodes[:self._count]
+
+  def append(self, node):
+    """
+    Returns:
+      AppendNode: A node that evaluates to this node followed by *node*.
+    """
+
+    nodes = self._nodes
+    if len(nodes) != self._count:
+      nodes = nodes[:self._count]
+    nodes.append(node)
+    return AppendNode(nodes)
+
+  def eval(self, context, args):
+    return ''.join([n.eval(context, args) for n in self.nodes])
+
+  def eval_value(self, context, args):
+    if self._count == 1:
+      return self._nodes[0].eval_value(context, args)
+    return self.eval(context, args)
+
+  def substitute(self, ref_name, node):
+    nodes = self.nodes
+    new_nodes = [n.substitute(ref_name, node) for n in nodes]
+    if all(a is b for a, b in zip(new_nodes, nodes)):
+      return self
+    return AppendNode(new_nodes)
+
+  def copy(self, new_context):
+    return AppendNode([n.copy(new_context) for n in self.nodes])
+
+  def compile(self):
+    return ConcatNode(list(self.nodes)).compile()
+
+  def compile_value(self):
+    if self._count == 1:
+      return self._nodes[0].compile_value()
+    return self.compile()
+
 
 class VarNode(ExpressionNode):
   """
   This expression node implements a variable expansion or function call.
+  If the node is bound to a *context*, the variable is always resolved
+  in that context, otherwise in the context passed to :meth:`eval`.
   """
 
   def __init__(self, varname, args, context):
     super().__init__()
     self.varname = varname
     self.args = args
-    self.context = weakref.ref(context)
+    self.context = weakref.ref(context) if context is not None else None
+
+    # Does the identifier access an argument?
+    try:
+      self.arg_index = int(varname)
+    except ValueError:
+      self.arg_index = None
+    else:
+      if self.arg_index < 0:
+        self.arg_index = None
 
   def eval(self, context, args):
-    if self.context:
-      context = self.context()
+    return to_str(self.eval_value(context, args))
+
+  def eval_value(self, context, args):
+    outer = context
+    if type(context) is SwitchedContext:
+      context, bound = context.context, True
+    else:
+      bound = self.context is not None
+      if bound:
+        context = outer = self.context()
 
     # Evaluate the arguments to the function.
-    sub_args = [TextNode(n.eval(context, args)) for n in self.args]
+    sub_args = [value_node(n.eval_value(outer, args)) for n in self.args]
+    return self.expand(context, args, sub_args, bound)
 
-    # Does the identifier access an argument?
-    arg_index = None
-    try:
-      arg_index = int(self.varname)
-    except ValueError:
-      pass
-    if arg_index is not None and arg_index >= 0 and arg_index < len(args):
-      return args[arg_index].eval(context, sub_args).strip()
+  def expand(self, context, args, sub_args, bound=True, compiled=False):
+    """
+    Expands the variable or calls the function with the already
+    evaluated *sub_args*. This is the part of :meth:`eval_value` that
+    is shared with the function returned by :meth:`compile_value`.
+    *bound* must be False if the node is not bound to a context. If
+    *compiled* is True, the macro is evaluated with the function
+    returned by :func:`compiled_value`.
+    """
+
+    arg_index = self.arg_index
+    if arg_index is not None and arg_index < len(args):
+      return strip(args[arg_index].eval_value(context, sub_args))
+
+    session = EvalSession._local.current
+    if session is not None:
+      if not bound:
+        session.untracked()
+      if not sub_args:
+        return session.expand(context, self.varname)
 
     # Try to get the macro and evaluate it.
     try:
       macro = context.get_macro(self.varname)
     except KeyError:
       return ''
-    return macro.eval(context, sub_args).strip()
+    if session is not None and isinstance(macro, Function) and not macro.pure:
+      session.untracked()
+    if compiled:
+      return strip(compiled_value(macro)(context, sub_args))
+    return strip(macro.eval_value(context, sub_args))
 
   def substitute(self, ref_name, node):
+    context = self.context() if self.context else None
     if ref_name == self.varname:
       return node
-    elif self.context():
-      namespace = self.context().get_namespace()
+    elif context:
+      namespace = context.get_namespace()
       if ref_name == creator.utils.create_var(namespace, self.varname):
         return node
-    for i in range(len(self.args)):
-      self.args[i] = self.args[i].substitute(ref_name, node)
-    return self
+    args = [n.substitute(ref_name, node) for n in self.args]
+    if all(a is b for a, b in zip(args, self.args)):
+      return self
+    return VarNode(self.varname, args, context)
 
   def copy(self, new_context):
+    if new_context is None and self.context:
+      new_context = self.context()
     args = [n.copy(new_context) for n in self.args]
     return VarNode(self.varname, args, new_context)
 
+  def compile(self):
+    return self._compile(True)
+
+  def compile_value(self):
+    return self._compile(False)
+
+  def _compile(self, to_text):
+    """
+    Private. Implements :meth:`compile` and :meth:`compile_value`, the
+    result is converted to a string if *to_text* is True.
+    """
+
+    ref = self.context
+    varname = self.varname
+    expand = self.expand
+    local = EvalSession._local
+    join = creator.utils.join
+
+    # Arguments that evaluate to constant text can be wrapped in
+    # TextNodes once instead of on every evaluation.
+    const_args = [const_text(n) for n in self.args]
+    if None not in const_args:
+      const_sub_args = [TextNode(t) for t in const_args]
+      arg_funcs = None
+    else:
+      arg_funcs = [n.compile_value() for n in self.args]
+
+    # Evaluations in an EvalSession go through expand(), otherwise the
+    # macro is looked up and its compiled function is called directly.
+    arg_index = self.arg_index
+    def func(context, args):
+      if ref:
+        context = ref()
+      if arg_funcs is None:
+        sub_args = const_sub_args
+      else:
+        sub_args = []
+        for f in arg_funcs:
+          value = f(context, args)
+          sub_args.append(TextNode(value) if type(value) is str else ListNode(value))
+      if arg_index is not None and arg_index < len(args):
+        value = strip(args[arg_index].eval_value(context, sub_args))
+      elif local.current is None:
+        try:
+          macro = context.get_macro(varname)
+        except KeyError:
+          return ''
+        try:
+          value = macro.__dict__['_compiled_value'](context, sub_args)
+        except KeyError:
+          value = compiled_value(macro)(context, sub_args)
+        value = value.strip() if type(value) is str else strip(value)
+      else:
+        value = expand(context, args, sub_args, bool(ref), True)
+      if to_text and type(value) is not str:
+        return join(value)
+      return value
+    return func
+
+
+class ContextSwitchNode(ExpressionNode):
+  """
+  Evaluates the expression tree *node* as if all of its variables were
+  bound to *context*. This has the same result as evaluating the tree
+  returned by ``node.copy(context)``, but the tree is shared instead of
+  copied (see :meth:`creator.unit.Unit.extends`). Use
+  :func:`switch_context` to create the node.
+  """
+
+  def __init__(self, node, context):
+    super().__init__()
+    self.node = node
+    self.context = weakref.ref(context)
+
+  def eval(self, context, args):
+    return to_str(self.eval_value(context, args))
+
+  def eval_value(self, context, args):
+    # If the node is part of a tree that is shared by another
+    # ContextSwitchNode, the outer context switch takes precedence
+    # just like it does when the tree is copied.
+    if type(context) is not SwitchedContext:
+      context = SwitchedContext(self.context())
+    return self.node.eval_value(context, args)
+
+  def substitute(self, ref_name, node):
+    context = self.context()
+    namespace, varname = creator.utils.parse_var(ref_name)
+    names = varnames(self.node)
+    if ref_name in names or (namespace == context.get_namespace() and varname in names):
+      # The shared tree can not be modified, thus it is copied.
+      return self.node.copy(context).substitute(ref_name, node)
+    return self
+
+  def copy(self, new_context):
+    if new_context is None:
+      new_context = self.context()
+    return ContextSwitchNode(self.node, new_context)
+
+
+def switch_context(node, context):
+  """
+  Returns a node that evaluates like ``node.copy(context)`` without
+  copying the tree of *node*.
+
+  Args:
+    node (ExpressionNode): The node to switch the context of.
+    context (ContextProvider): The context to resolve the variables in.
+  Returns:
+    ExpressionNode: *node* if it does not depend on the context, or
+      a :class:`ContextSwitchNode`.
+  """
+
+  if isinstance(node, (TextNode, ListNode, Function)):
+    return node
+  if isinstance(node, ContextSwitchNode):
+    node = node.node
+  return ContextSwitchNode(node, context)
+
+
+def varnames(node):
+  """
+  Returns the names of the variables that are referenced in the tree
+  of *node*. The result is cached with the node.
+
+  Returns:
+    frozenset of str: The variable names.
+  """
+
+  try:
+    return node.__dict__['_varnames']
+  except KeyError:
+    pass
+  if isinstance(node, VarNode):
+    names = {node.varname}
+    children = node.args
+  elif isinstance(node, (ConcatNode, AppendNode)):
+    names = set()
+    children = node.nodes
+  elif isinstance(node, ContextSwitchNode):
+    names = set()
+    children = [node.node]
+  else:
+    return frozenset()
+  for child in children:
+    names.update(varnames(child))
+  names = node._varnames = frozenset(names)
+  return names
+
 
 class Function(ExpressionNode):
   """
   This class can be used to wrap a Python function to make it a
   function that can be called from a macro. The wrapped function
-  must accept the same arguments as :meth:`eval`.
+  must accept the same arguments as :meth:`eval`. It may return a
+  list of strings instead of a string (see :meth:`eval_value`).
+
+  Attributes:
+    pure (bool): True if the result of the function depends only on
+      its arguments and the macros it reads. Values that called an
+      impure function are not reused by an :class:`EvalSession` after
+      the session ended. False unless specified otherwise, since a
+      function may read anything, eg. files or the environment.
   """
 
-  def __init__(self, func):
+  def __init__(self, func, pure=False):
     super().__init__()
     self.func = func
+    self.pure = pure
 
   @property
   def name(self):
     return self.func.__name__
 
   def eval(self, context, args):
+    return to_str(self.func(context, args))
+
+  def eval_value(self, context, args):
     return self.func(context, args)
 
   def substitute(self, ref_name, node):
@@ -448,11 +1046,269 @@ class Function(ExpressionNode):
   def copy(self, new_context):
     return self
 
+  def compile_value(self):
+    return self.func
+
+
+class ResponseFile(object):
+  """
+  Collects the arguments that ``$(rsp ...)`` moves out of a command
+  while the command is evaluated. Use the object as a context manager
+  around the evaluation, it is active only in the current thread.
+
+  Attributes:
+    filename (str): The name of the response file.
+    threshold (int): The text passed to ``$(rsp ...)`` is only moved to
+      the response file if it is longer than this number of characters.
+    content (list of str): The text that has been moved to the file.
+  """
+
+  _local = threading.local()
+
+  def __init__(self, filename, threshold):
+    super().__init__()
+    self.filename = filename
+    self.threshold = threshold
+    self.content = []
+
+  def __enter__(self):
+    self._outer = getattr(self._local, 'current', None)
+    self._local.current = self
+    return self
+
+  def __exit__(self, *exc_info):
+    self._local.current = self._outer
+
+  @classmethod
+  def current(cls):
+    """
+    Returns:
+      ResponseFile: The active response file or None.
+    """
+
+    return getattr(cls._local, 'current', None)
+
+
+class EvalSession(object):
+  """
+  Caches the values of variables that are expanded without arguments
+  while an expression is evaluated, so that eg. ``$BuildDir`` is only
+  evaluated once if it is referenced many times. Use the object as a
+  context manager around the evaluation, it is active only in the
+  current thread. Values are cached per context, the macros must not
+  change while the session is active, except for the macros listed
+  in *watch*.
+
+  A value is not cached if a watched macro or a volatile function (see
+  :meth:`volatile`) was evaluated for it, eg. ``$(rsp ...)`` while a
+  :class:`ResponseFile` is active.
+
+  The session also records which macros of a :class:`MutableContext`
+  and which of their versions are read by an evaluation. The value of
+  a macro is stored with the macro and reused by later sessions until
+  one of the macros it read is changed (see :meth:`eval_macro`).
+
+  Attributes:
+    watch (frozenset of str): Names of macros that may change while
+      the session is active. Eg. ``Target.build_each()`` shares one
+      session for all files while ``$<`` and ``$@`` change.
+    values (dict of (ContextProvider, str) -> (str or list of str, list)):
+      The cached values and the macros that were read for them.
+    reads (list of tuple): The ``(context, name, version)`` of every
+      macro that has been read from a :class:`MutableContext` while a
+      value is evaluated that will be cached or stored. None is listed
+      if something was read that can not be tracked. The reads of a
+      value are removed again once the outermost value is cached.
+    depth (int): The number of values that are currently evaluated by
+      :meth:`expand` and :meth:`eval_macro`. Reads are only recorded
+      if it is not zero.
+    hits (int): The number of expansions served from :attr:`values`.
+    misses (int): The number of expansions that had to be evaluated.
+    macro_hits (int): The number of macro values that have been reused
+      from an earlier evaluation.
+  """
+
+  class _Local(threading.local):
+    current = None
+
+  _local = _Local()
+
+  def __init__(self, watch=()):
+    super().__init__()
+    self.watch = frozenset(watch)
+    self.values = {}
+    self.reads = []
+    self.depth = 0
+    self.hits = 0
+    self.misses = 0
+    self.macro_hits = 0
+    self._volatile = 0
+
+  def __enter__(self):
+    self._outer = self._local.current
+    self._local.current = self
+    return self
+
+  def __exit__(self, *exc_info):
+    self._local.current = self._outer
+
+  @classmethod
+  def current(cls):
+    """
+    Returns:
+      EvalSession: The active session or None.
+    """
+
+    return cls._local.current
+
+  @classmethod
+  def enter(cls, watch=()):
+    """
+    Returns:
+      EvalSession: A new session, or a session that does nothing if
+        there already is an active session that the evaluation can be
+        part of.
+    """
+
+    current = cls.current()
+    if current is not None and current.watch.issuperset(watch):
+      return _NullSession()
+    return cls(watch)
+
+  def volatile(self):
+    """
+    Prevents the values that are currently being evaluated from being
+    cached. Called by macro functions that do not always return the
+    same value for the same arguments.
+    """
+
+    self._volatile += 1
+
+  def untracked(self):
+    """
+    Prevents the values that are currently being evaluated from being
+    reused after the session ended. Called when something is read that
+    is not recorded in :attr:`reads`.
+    """
+
+    if self.depth:
+      self.reads.append(None)
+
+  def expand(self, context, varname):
+    """
+    Expands the variable *varname* in *context* without arguments like
+    :meth:`VarNode.expand` and caches the value.
+
+    Returns:
+      str or list of str: The value of the variable.
+    """
+
+    key = (context, varname)
+    try:
+      value, reads = self.values[key]
+    except KeyError:
+      pass
+    else:
+      self.hits += 1
+      if self.depth:
+        self.reads.extend(reads)
+      return value
+
+    self.misses += 1
+    start, volatile = len(self.reads), self._volatile
+    self.depth += 1
+    try:
+      try:
+        macro = context.get_macro(varname)
+      except KeyError:
+        macro = None
+        value = ''
+      else:
+        if isinstance(macro, Function):
+          if not macro.pure:
+            self.untracked()
+          value = strip(macro.eval_value(context, []))
+        else:
+          value = strip(self.eval_macro(macro, context))
+      if varname in self.watch or isinstance(macro, Function):
+        self._volatile += 1
+      elif volatile == self._volatile:
+        self.values[key] = (value, self.reads[start:])
+    finally:
+      self.depth -= 1
+      if not self.depth:
+        del self.reads[start:]
+    return value
+
+  def eval_macro(self, macro, context):
+    """
+    Evaluates *macro* without arguments in *context* and stores the
+    value with the macro. If the macros that have been read for the
+    stored value did not change since, it is returned instead.
+
+    Args:
+      macro (ExpressionNode): A macro that has been retrieved from
+        *context*.
+      context (ContextProvider): The context to evaluate in.
+    Returns:
+      str or list of str: The value of the macro.
+    """
+
+    if isinstance(macro, (TextNode, ListNode, Function)):
+      return macro.eval_value(context, [])
+
+    stored = macro.__dict__.get('_stored_value')
+    if stored is not None:
+      value, reads = stored
+      if all(c.versions.get(n, 0) == v for c, n, v in reads):
+        self.macro_hits += 1
+        if self.depth:
+          self.reads.extend(reads)
+        return value
+
+    start, volatile = len(self.reads), self._volatile
+    self.depth += 1
+    try:
+      value = macro.eval_value(context, [])
+      reads = self.reads[start:]
+      if volatile == self._volatile and None not in reads:
+        # Nodes are not modified after they have been set as a macro,
+        # thus the value can be stored with the node itself.
+        macro._stored_value = (value, reads)
+    finally:
+      self.depth -= 1
+      if not self.depth:
+        del self.reads[start:]
+    return value
+
+
+class _NullSession(object):
+
+  def __enter__(self):
+    return EvalSession.current()
+
+  def __exit__(self, *exc_info):
+    pass
+
 
 class Parser(object):
   """
   This class implements the process of parsing a string into an
-  expression node hierarchy.
+  expression node hierarchy. Parsed trees are kept in a bounded LRU
+  cache keyed by the text and context, thus :meth:`parse` may return
+  the same tree for multiple calls. Expression trees must never be
+  modified in place (see :meth:`ExpressionNode.substitute`).
+
+  Args:
+    cache_size (int): The maximum number of expression trees in the
+      parse cache. Zero disables the cache.
+
+  Attributes:
+    cache_size (int): The maximum number of cached expression trees.
+    cache_hits (int): The number of :meth:`parse` calls that were
+      served from the cache.
+    cache_misses (int): The number of :meth:`parse` calls that had
+      to actually parse the text.
   """
 
   CHARS_WHITESPACE = string.whitespace
@@ -464,17 +1320,213 @@ class Parser(object):
   CHAR_NAMESPACEACCESS = ':'
   CHAR_ARGSEP = ','
 
+  def __init__(self, cache_size=4096):
+    super().__init__()
+    self.cache_size = cache_size
+    self.cache_hits = 0
+    self.cache_misses = 0
+    self._cache = collections.OrderedDict()
+    self._regexes = {}
+
+  def clear_cache(self):
+    """
+    Removes all expression trees from the parse cache and resets the
+    hit and miss counters.
+    """
+
+    self._cache.clear()
+    self.cache_hits = 0
+    self.cache_misses = 0
+
   def parse(self, text, context):
     """
     Args:
       text (str): The text to parse into an expression tree.
+      context (ContextProvider or None): The context that variable
+        references are bound to, or None to resolve them in the context
+        that the tree is evaluated with.
     Returns:
       ConcatNode: The root node of the hierarchy.
     """
 
     if context is not None and not isinstance(context, ContextProvider):
       raise TypeError('context must be None or ContextProvider', type(context))
-    scanner = creator.utils.Scanner(text.strip())
+
+    # The context is referenced weakly so the cache does not keep
+    # it alive, a dead reference never compares equal to a new one.
+    key = (text, weakref.ref(context) if context is not None else None)
+    try:
+      node = self._cache[key]
+    except KeyError:
+      self.cache_misses += 1
+    else:
+      self.cache_hits += 1
+      self._cache.move_to_end(key)
+      return node
+
+    node = self._parse(text.strip(), context)
+    if self.cache_size > 0:
+      self._cache[key] = node
+      if len(self._cache) > self.cache_size:
+        self._cache.popitem(last=False)
+    return node
+
+  def _parse(self, text, context):
+    """
+    Private. Parses *text* into an expression tree. The text is split
+    into tokens with regular expressions so that runs of literal text
+    and identifiers are consumed with a single match.
+    """
+
+    node, pos = self._parse_arg(text, 0, context, closing_at='')
+    return node
+
+  def _regex(self, chars, invert=False):
+    """
+    Private. Returns a compiled regular expression that matches one or
+    more of the specified *chars*, or any other characters if *invert*
+    is True.
+    """
+
+    key = (chars, invert)
+    try:
+      return self._regexes[key]
+    except KeyError:
+      pass
+    regex = re.compile('[' + ('^' if invert else '') + re.escape(chars) + ']+')
+    self._regexes[key] = regex
+    return regex
+
+  def _skip(self, text, pos, chars):
+    """
+    Private. Returns the position of the first character at or after
+    *pos* in *text* that is not in *chars*.
+    """
+
+    match = self._regex(chars).match(text, pos)
+    return match.end() if match else pos
+
+  def _parse_arg(self, text, pos, context, closing_at):
+    root = ConcatNode()
+    literal = self._regex('$\\' + closing_at, invert=True)
+    end = len(text)
+    while pos < end:
+      match = literal.match(text, pos)
+      if match:
+        root.append(match.group())
+        pos = match.end()
+        continue
+
+      char = text[pos]
+      if char == '$':
+        pos += 1
+        node = None
+        if text[pos:pos + 1] != '$':
+          node, new_pos = self._parse_macro(text, pos, context)
+        if node:
+          root.append(node)
+          pos = new_pos
+        else:
+          # Note that the character after the $ is skipped, which
+          # is what makes $$ evaluate to a single $.
+          root.append('$')
+          pos += 1
+      elif char == '\\':
+        pos += 1
+        if pos < end:
+          root.append(text[pos])
+          pos += 1
+        else:
+          root.append('\\')
+      else:
+        # One of the characters in closing_at.
+        break
+
+    return root, pos
+
+  def _parse_macro(self, text, pos, context):
+    end = len(text)
+    char = text[pos:pos + 1]
+
+    # Check if a shortcut identifier was used.
+    shortcut = None
+    if char in Globals.shortcut_map:
+      shortcut = Globals.shortcut_map[char]
+      pos += 1
+      char = text[pos:pos + 1]
+
+    is_call = False
+    is_braced = False
+
+    # Check if we have an opening parenthesis (function call).
+    if char == self.CHAR_POPEN:
+      is_call = True
+      closing = self.CHAR_PCLOSE
+      pos += 1
+
+    # Or if we got braces (enclosed variable expansion).
+    elif char == self.CHAR_BOPEN:
+      is_braced = True
+      closing = self.CHAR_BCLOSE
+      pos = self._skip(text, pos + 1, self.CHARS_WHITESPACE)
+
+    # If a shortcut was used and this is a call, we already know
+    # the function that is used to call.
+    if shortcut and is_call:
+      varname = shortcut
+
+    # Read the variable or function name that is referenced
+    # in this expression.
+    else:
+      match = self._regex(self.CHARS_IDENTIFIER).match(text, pos)
+      if not match:
+        return None, pos
+      varname = match.group()
+      pos = match.end()
+
+    # If its a function call, we need to read in the arguments.
+    if is_call:
+      args = []
+      pos = self._skip(text, pos, self.CHARS_WHITESPACE)
+      closing_at = closing + self.CHAR_ARGSEP
+      while pos < end and text[pos] != closing:
+        node, pos = self._parse_arg(text, pos, context, closing_at)
+        args.append(node)
+        char = text[pos:pos + 1]
+        if char == self.CHAR_ARGSEP:
+          pos += 1
+        elif char == closing:
+          break
+        # Skip whitespace after the argument separator.
+        pos = self._skip(text, pos, self.CHARS_WHITESPACE)
+      if text[pos:pos + 1] != closing:
+        return None, pos
+      return VarNode(varname, args, context), pos + 1
+
+    # If its braced, we only need the name of the variable that
+    # is being referenced.
+    elif is_braced:
+      pos = self._skip(text, pos, self.CHARS_WHITESPACE)
+      if text[pos:pos + 1] != closing:
+        return None, pos
+      pos += 1
+
+    node = VarNode(varname, [], context)
+    if shortcut:
+      node = VarNode(shortcut, [node], context)
+    return node, pos
+
+
+class ScannerParser(Parser):
+  """
+  The original :class:`Parser` implementation that processes the text
+  one character at a time with a :class:`creator.utils.Scanner`. It is
+  kept as a reference implementation to compare the results of the
+  :class:`Parser` against.
+  """
+
+  def _parse(self, text, context):
+    scanner = creator.utils.Scanner(text)
     return self._parse_arg(scanner, context, closing_at='')
 
   def _parse_arg(self, scanner, context, closing_at):
@@ -581,6 +1633,28 @@ parser = Parser()
 parse = parser.parse
 
 
+def parse_appendix(text, context):
+  """
+  Like :func:`parse`, but keeps the leading whitespace of *text* which
+  is significant for a value that is appended to a macro, see
+  :meth:`MutableContext.append`.
+  """
+
+  node = parse(text, context)
+  stripped = text.lstrip()
+  if len(stripped) != len(text) and stripped:
+    node = ConcatNode([TextNode(text[:len(text) - len(stripped)]), node])
+  return node
+
+
+def pure_function(func):
+  """
+  Decorator that wraps *func* in a :class:`Function` that is pure.
+  """
+
+  return Function(func, pure=True)
+
+
 class Globals:
 
   shortcut_map = {
@@ -589,60 +1663,56 @@ class Globals:
     '*': 'wildcard',
   }
 
-  @Function
+  @pure_function
   def addprefix(context, args):
     if len(args) != 2:
       message = 'addprefix requires 2 arguments, got {0}'.format(len(args))
       raise TypeError(message)
     prefix = args[0].eval(context, [])
-    items = creator.utils.split(args[1].eval(context, []))
-    items = [prefix + x for x in items]
-    return creator.utils.join(items)
+    items = to_list(args[1].eval_value(context, []))
+    return [prefix + x for x in items]
 
-  @Function
+  @pure_function
   def addsuffix(context, args):
     if len(args) != 2:
       message = 'addsuffix requires 2 arguments, got {0}'.format(len(args))
       raise TypeError(message)
     suffix = args[0].eval(context, [])
-    items = creator.utils.split(args[1].eval(context, []))
-    items = [x + suffix for x in items]
-    return creator.utils.join(items)
+    items = to_list(args[1].eval_value(context, []))
+    return [x + suffix for x in items]
 
-  @Function
+  @pure_function
   def quote(context, args):
     items = [n.eval(context, []).strip() for n in args]
     items = [creator.utils.quote(x) for x in items]
     return ' '.join(items)
 
-  @Function
+  @pure_function
   def quoteall(context, args):
-    items = ';'.join(n.eval(context, []).strip() for n in args)
-    items = [creator.utils.quote(x) for x in creator.utils.split(items)]
-    return creator.utils.join(items)
+    items = eval_list(context, args, strip_items=True)
+    return [creator.utils.quote(x) for x in items]
 
-  @Function
+  @pure_function
   def quotesplit(context, args):
-    items = ';'.join(n.eval(context, []).strip() for n in args)
-    items = creator.utils.split(items)
+    items = eval_list(context, args, strip_items=True)
     items = [creator.utils.quote(x) for x in items]
     return ' '.join(items)
 
-  @Function
+  @pure_function
   def subst(context, args):
     if len(args) != 3:
       message = 'subst requires 3 arguments, got {0}'.format(len(args))
       raise TypeError(message)
-    subject, replacement, items = [n.eval(context, []).strip() for n in args]
-    items = creator.utils.split(items)
-    items = [x.replace(subject, replacement) for x in items]
-    return creator.utils.join(items)
+    subject, replacement = [n.eval(context, []).strip() for n in args[:2]]
+    items = to_list(strip(args[2].eval_value(context, [])))
+    return [x.replace(subject, replacement) for x in items]
 
-  @Function
+  @pure_function
   def split(context, args):
-    items = ';'.join(n.eval(context, []).strip() for n in args)
-    return ' '.join(creator.utils.split(items))
+    items = eval_list(context, args, strip_items=True)
+    return ' '.join(items)
 
+  # The files may change while the macros stay the same.
   @Function
   def wildcard(context, args):
     patterns = [n.eval(context, []).strip() for n in args]
@@ -650,72 +1720,98 @@ class Globals:
     for pattern in patterns:
       items.extend(creator.utils.glob2(pattern))
     items.sort()
-    return creator.utils.join(items)
+    return items
 
-  @Function
+  @pure_function
   def suffix(context, args):
     if len(args) != 2:
       message = 'suffix requires 2 arguments, got {0}'.format(len(args))
       raise TypeError(message)
-    items, suffix = [n.eval(context, []).strip() for n in args]
-    items = creator.utils.split(items)
-    items = [creator.utils.set_suffix(x, suffix) for x in items]
-    return creator.utils.join(items)
+    items = to_list(strip(args[0].eval_value(context, [])))
+    suffix = args[1].eval(context, []).strip()
+    return [creator.utils.set_suffix(x, suffix) for x in items]
 
-  @Function
+  @pure_function
   def prefix(context, args):
     if len(args) != 2:
       message = 'prefix requires 2 arguments, got {0}'.format(len(args))
       raise TypeError(message)
-    items, prefix = [n.eval(context, []).strip() for n in args]
+    items = to_list(strip(args[0].eval_value(context, [])))
+    prefix = args[1].eval(context, []).strip()
     result = []
-    for item in creator.utils.split(items):
+    for item in items:
       dirname, basename = os.path.split(item)
       basename = prefix + basename
       result.append(os.path.join(dirname, basename))
-    return creator.utils.join(result)
+    return result
 
-  @Function
+  @pure_function
   def move(context, args):
     if len(args) != 3:
       message = 'move requires 3 arguments, got {0}'.format(len(args))
       raise TypeError(message)
-    items, base, new_base = [n.eval(context, []).strip() for n in args]
+    items = to_list(strip(args[0].eval_value(context, [])))
+    base, new_base = [n.eval(context, []).strip() for n in args[1:]]
     result = []
-    for item in creator.utils.split(items):
+    for item in items:
       relpath = os.path.relpath(item, base)
       result.append(os.path.join(new_base, relpath))
-    return creator.utils.join(result)
+    return result
 
-  @Function
+  @pure_function
   def dir(context, args):
-    items = ';'.join(n.eval(context, []) for n in args)
-    items = creator.utils.split(items)
-    return creator.utils.join(os.path.dirname(x) for x in items)
+    items = eval_list(context, args)
+    return [os.path.dirname(x) for x in items]
 
+  # The result depends on the working and the home directory.
   @Function
   def normpath(context, args):
-    items = ';'.join(n.eval(context, []).strip() for n in args)
-    items = creator.utils.split(items)
-    return creator.utils.join(creator.utils.normpath(x) for x in items)
+    items = eval_list(context, args, strip_items=True)
+    return [creator.utils.normpath(x) for x in items]
 
-  @Function
+  @pure_function
   def upper(context, args):
     if len(args) != 1:
       message = 'upper expects exactly 1 argument, got {0}'.format(len(args))
       raise TypeError(message)
     return args[0].eval(context, []).upper()
 
-  @Function
+  @pure_function
   def lower(context, args):
     if len(args) != 1:
       message = 'lower expects exactly 1 argument, got {0}'.format(len(args))
       raise TypeError(message)
     return args[0].eval(context, []).lower()
 
-  @Function
+  @pure_function
   def capitalize(context, args):
     if len(args) != 1:
       message = 'lower expects exactly 1 argument, got {0}'.format(len(args))
       raise TypeError(message)
     return string.capwords(args[0].eval(context, []))
+
+  # The result depends on the active response file.
+  @Function
+  def rsp(context, args):
+    # Moves the text to the active response file if it is too long and
+    # references the file instead. The text of all calls is collected in
+    # the same file, thus only the first call returns the reference.
+    text = ' '.join(n.eval(context, []).strip() for n in args)
+    rspfile = ResponseFile.current()
+    if rspfile is None:
+      return text
+    session = EvalSession.current()
+    if session is not None:
+      session.volatile()
+    if len(text) <= rspfile.threshold:
+      return text
+    rspfile.content.append(text)
+    if len(rspfile.content) > 1:
+      return ''
+    return '@' + creator.utils.quote(rspfile.filename)
+
+
+# Maps the names of the built-in macro functions to their Function.
+Globals.functions = {
+  name: value for name, value in vars(Globals).items()
+  if isinstance(value, Function)}
@@ -0,0 +1,276 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+The manifest records everything that went into exporting the build
+definitions, so that a later invocation can tell whether the unit
+scripts need to be executed again at all.
+"""
+
+import creator
+import creator.unit
+import creator.utils
+
+import hashlib
+import json
+import os
+import sys
+
+
+def stat_file(filename):
+  """
+  Returns:
+    list of int: The modification time in nanoseconds and the size of
+    *filename* or None if the file does not exist.
+  """
+
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return None
+  return [st.st_mtime_ns, st.st_size]
+
+
+def hash_listing(dirs, files, suffix=''):
+  """
+  Returns:
+    str: A hash of the names of the subdirectories *dirs* and of the
+    *files* that end with *suffix*.
+  """
+
+  files = sorted(x for x in files if x.endswith(suffix))
+  data = '\0'.join(sorted(dirs)) + '\1' + '\0'.join(files)
+  return hashlib.sha1(data.encode('utf8', 'surrogateescape')).hexdigest()
+
+
+def stat_dir(dirname, suffix=''):
+  """
+  Returns:
+    list: The modification time of *dirname* in nanoseconds and the
+    result of :func:`hash_listing` for its contents, or None if the
+    directory does not exist.
+  """
+
+  try:
+    mtime = os.stat(dirname).st_mtime_ns
+    dirs, files = [], []
+    with os.scandir(dirname) as it:
+      for entry in it:
+        (dirs if entry.is_dir() else files).append(entry.name)
+  except OSError:
+    return None
+  return [mtime, hash_listing(dirs, files, suffix)]
+
+
+def dir_changed(dirname, value, suffix=''):
+  """
+  Returns:
+    bool: True if *dirname* changed compared to *value*, the result of
+    :func:`stat_dir` from earlier. If only the modification time of the
+    directory changed but the names in it did not, eg. because files
+    have been written to it, it is considered unchanged.
+  """
+
+  if value is None:
+    return os.path.isdir(dirname)
+  try:
+    if os.stat(dirname).st_mtime_ns == value[0]:
+      return False
+  except OSError:
+    return True
+  current = stat_dir(dirname, suffix)
+  return current is None or current[1] != value[1]
+
+
+def listing_stats(index, suffix=''):
+  """
+  Returns:
+    dict of str -> list: The directories listed by the
+    :class:`creator.utils.DirectoryIndex` *index* mapped to a value like
+    it is returned by :func:`stat_dir`. The hash is computed from the
+    listing the index has actually used.
+  """
+
+  result = {}
+  for dirname, (mtime, dirs, files, links) in index.listings().items():
+    if mtime == -1:
+      result[dirname] = None
+    else:
+      result[dirname] = [mtime, hash_listing(dirs, files, suffix)]
+  return result
+
+
+class Manifest(object):
+  """
+  Fingerprint of an export of the build definitions.
+
+  Attributes:
+    options (dict): The command-line options that affect the build
+      definitions, eg. the defines and the main unit.
+    output (str): The filename of the exported build definitions.
+    output_stat (list of int): The result of :func:`stat_file` for the
+      :attr:`output` file when the manifest was saved.
+    files (dict of str -> list): Maps the filenames of the unit scripts
+      that have been executed and the users ``.creator_profile`` to the
+      result of :func:`stat_file`.
+    dirs (dict of str -> list): Maps the directories listed by
+      ``$(wildcard ...)`` to the result of :func:`stat_dir`.
+    unit_dirs (dict of str -> list): Maps the directories of the unit
+      search path that have been searched for unit scripts to the
+      result of :func:`stat_dir` for the ``.crunit`` files.
+    environ (dict of str -> str): The environment variables that have
+      been consulted as macros and their value.
+    targets (dict of str -> str): Maps the full identifiers of all
+      targets and tasks to either ``'target'`` or ``'task'``.
+  """
+
+  version = 2
+
+  def __init__(self, options, output):
+    super().__init__()
+    self.options = options
+    self.output = output
+    self.output_stat = None
+    self.files = {}
+    self.dirs = {}
+    self.unit_dirs = {}
+    self.environ = {}
+    self.targets = {}
+
+  @classmethod
+  def from_workspace(cls, workspace, options, output):
+    """
+    Creates a :class:`Manifest` from the state of the *workspace* after
+    its units have been loaded and its targets have been set up.
+    """
+
+    manifest = cls(options, output)
+    manifest.files[workspace.profile] = stat_file(workspace.profile)
+    for unit in workspace.units.values():
+      filename = unit.scope.get('__file__')
+      if filename:
+        manifest.files[filename] = stat_file(filename)
+      for target in unit.targets.values():
+        kind = 'target' if isinstance(target, creator.unit.Target) else 'task'
+        manifest.targets[target.identifier] = kind
+    manifest.dirs = listing_stats(creator.utils.dir_index)
+    manifest.unit_dirs = listing_stats(workspace.unit_index, '.crunit')
+    manifest.environ.update(workspace.context.environ)
+    return manifest
+
+  @classmethod
+  def load(cls, filename):
+    """
+    Returns:
+      Manifest: The manifest loaded from *filename* or None if the file
+      does not exist, is corrupt or was written by another version of
+      *Creator* or Python.
+    """
+
+    try:
+      with open(filename) as fp:
+        data = json.load(fp)
+      if data['version'] != [cls.version, creator.__version__, sys.version]:
+        return None
+      manifest = cls(data['options'], data['output'])
+      manifest.output_stat = data['output_stat']
+      manifest.files = data['files']
+      manifest.dirs = data['dirs']
+      manifest.unit_dirs = data['unit_dirs']
+      manifest.environ = data['environ']
+      manifest.targets = data['targets']
+    except (OSError, ValueError, KeyError, TypeError):
+      return None
+    return manifest
+
+  def save(self, filename):
+    """
+    Saves the manifest to *filename*. The modification time and size of
+    the :attr:`output` file are recorded as well, thus the manifest must
+    be saved after the build definitions have been exported.
+    """
+
+    self.output_stat = stat_file(self.output)
+    data = {
+      'version': [self.version, creator.__version__, sys.version],
+      'options': self.options,
+      'output': self.output,
+      'output_stat': self.output_stat,
+      'files': self.files,
+      'dirs': self.dirs,
+      'unit_dirs': self.unit_dirs,
+      'environ': self.environ,
+      'targets': self.targets,
+    }
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    with open(filename, 'w') as fp:
+      json.dump(data, fp)
+
+  def fingerprint(self):
+    """
+    Returns:
+      str: A hash of the contents of the manifest. It identifies the
+      state of the workspace the manifest has been created from and is
+      only meaningful after the manifest has been saved or loaded.
+    """
+
+    data = [self.options, self.output, self.output_stat, self.files,
+      self.dirs, self.unit_dirs, self.environ, self.targets]
+    data = json.dumps(data, sort_keys=True)
+    return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+  def inputs(self):
+    """
+    Returns:
+      list of str: The names of the existing files and directories that
+      have been recorded in the manifest.
+    """
+
+    files = [k for k, v in self.files.items() if v is not None]
+    dirs = [k for k, v in self.dirs.items() if v is not None]
+    return files + dirs
+
+  def is_up_to_date(self, options):
+    """
+    Returns:
+      bool: True if the *options* equal the :attr:`options` and none of
+      the files, directories and environment variables that have been
+      recorded changed since the manifest was created.
+    """
+
+    if options != self.options:
+      return False
+    if not self.output_stat or stat_file(self.output) != self.output_stat:
+      return False
+    for filename, value in self.files.items():
+      if stat_file(filename) != value:
+        return False
+    for dirname, value in self.dirs.items():
+      if dir_changed(dirname, value):
+        return False
+    for dirname, value in self.unit_dirs.items():
+      if dir_changed(dirname, value, '.crunit'):
+        return False
+    for name, value in self.environ.items():
+      if os.environ.get(name) != value:
+        return False
+    return True
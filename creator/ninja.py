@@ -18,13 +18,19 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import creator.platform
 import creator.utils
+import hashlib
+import io
+import json
+import os
 import re
 
-from creator.vendor.ninja_syntax import Writer
+from creator.vendor.ninja_syntax import Writer, escape, escape_path
 
 
-def export(fp, workspace, unit, default_targets=()):
+def export(fp, workspace, unit, default_targets=(), generator=None,
+    subninja_dir=None, compdb=None):
   """
   Exports the build definitions for all units in the :class:`Workspace`
   to the file-like object *fp*.
@@ -36,6 +42,23 @@ def export(fp, workspace, unit, default_targets=()):
       identifiers.
     default_targets (list of str): A list of target names, or None to
       let ninja build everything on default invokation.
+    generator (tuple of (str, str, list of str)): The filename of the
+      build definitions, the command that regenerates them and the files
+      and directories they depend on. If specified, a ``generator`` rule
+      is exported so that ninja regenerates the file when any of these
+      inputs changed.
+    subninja_dir (str): If specified, the build definitions of every unit
+      are written to a separate file in this directory that is included
+      with ``subninja``, see :func:`export_unit` and :func:`unit_filename`.
+    compdb (str): If specified, the compilation database is written to
+      this file as well, see :func:`export_compdb`. With *subninja_dir*,
+      the entries of every unit are kept in a separate file in the
+      ``<compdb>.d`` directory.
+
+  The pools used by the targets are declared with the depth from the
+  ``$pool.<name>`` macro of the global context. It defaults to the
+  number of CPUs if the macro is not defined, see also
+  :func:`creator.platform.default_pool_depths`.
 
   Raises:
     ValueError: If any of the targets do not exist.
@@ -43,14 +66,64 @@ def export(fp, workspace, unit, default_targets=()):
 
   writer = Writer(fp, width=1024)
 
-  for unit in sorted(workspace.units.values(), key=lambda x: x.identifier):
-    if not unit.targets:
-      continue
-    writer.comment('Unit: {0}'.format(unit.identifier))
+  if generator is not None:
+    filename, command, inputs = generator
+    writer.comment('Regenerate the build definitions.')
+    writer.newline()
+    writer.rule('creator_generate', escape(command),
+      description='Regenerating {0}'.format(escape(filename)), generator=True)
+    writer.build(filename, 'creator_generate', sorted(inputs))
     writer.newline()
-    for target in sorted(unit.targets.values(), key=lambda x: x.name):
-      if isinstance(target, creator.unit.Target):
-        target.export(writer)
+
+    # Phony edges for the inputs keep ninja from failing if any of them
+    # is deleted, it will just regenerate the build definitions.
+    outputs = set()
+    for unit_ in workspace.units.values():
+      for target in unit_.targets.values():
+        if isinstance(target, creator.unit.Target):
+          for entry in target.command_data:
+            outputs.update(map(creator.utils.normpath, entry['outputs']))
+    for path in sorted(inputs):
+      if creator.utils.normpath(path) not in outputs:
+        writer.build(path, 'phony')
+    writer.newline()
+
+  units = sorted(workspace.units.values(), key=lambda x: x.identifier)
+  units = [x for x in units if x.targets]
+
+  # Pools are global in ninja, thus they are declared in this file
+  # before any of them is used, also by the subninja files.
+  pools = pool_depths(workspace, units)
+  if pools:
+    writer.comment('Pools')
+    for name in sorted(pools):
+      writer.pool(name, pools[name])
+    writer.newline()
+  if subninja_dir is None:
+    rules = {}
+    for unit_ in units:
+      export_unit(writer, unit_, rules)
+  else:
+    filenames = set()
+    for unit_ in units:
+      name = unit_filename(unit_.identifier, '.ninja')
+      filename = os.path.join(subninja_dir, name)
+      with io.StringIO() as buffer:
+        export_unit(Writer(buffer, width=1024), unit_, {})
+        creator.utils.write_if_changed(filename, buffer.getvalue())
+      writer.subninja(escape_path(filename))
+      filenames.add(name)
+    writer.newline()
+
+    # Remove the files of units that no longer exist.
+    names = os.listdir(subninja_dir) if os.path.isdir(subninja_dir) else []
+    for name in names:
+      if name.endswith('.ninja') and name not in filenames:
+        os.remove(os.path.join(subninja_dir, name))
+
+  if compdb is not None:
+    fragment_dir = compdb + '.d' if subninja_dir is not None else None
+    export_compdb(compdb, units, fragment_dir)
 
   if default_targets:
     defaults = set()
@@ -71,6 +144,199 @@ def export(fp, workspace, unit, default_targets=()):
     writer.default(list(defaults))
 
 
+def pool_depths(workspace, units):
+  """
+  Returns:
+    dict of str -> int: The names of the pools used by the targets of
+    the *units* mapped to their depth. The built-in ``console`` pool of
+    ninja is not included.
+  """
+
+  names = set()
+  for unit in units:
+    for target in unit.targets.values():
+      if isinstance(target, creator.unit.Target):
+        for entry in target.command_data:
+          names.add(entry.get('pool') or target.pool)
+  names.discard(None)
+  names.discard('console')
+
+  context = workspace.context
+  result = {}
+  for name in names:
+    macro = context.macros.get('pool.' + name)
+    depth = macro.eval(context, []).strip() if macro is not None else ''
+    if depth:
+      result[name] = int(depth)
+    else:
+      result[name] = creator.platform.cpu_count()
+  return result
+
+
+def export_unit(writer, unit, rules):
+  """
+  Exports the targets of a single *unit* using the *writer*.
+
+  Args:
+    writer (ninja_syntax.Writer): The writer to export to.
+    unit (Unit): The unit to export.
+    rules (dict of str -> str): Passed to :meth:`Target.export`.
+  """
+
+  writer.comment('Unit: {0}'.format(unit.identifier))
+  writer.newline()
+  for target in sorted(unit.targets.values(), key=lambda x: x.name):
+    if isinstance(target, creator.unit.Target):
+      target.export(writer, rules)
+
+
+#: The suffixes of the source files whose commands are exported to the
+#: compilation database by :func:`export_compdb`.
+COMPDB_SUFFIXES = frozenset(['.c', '.cc', '.cpp', '.cxx', '.c++', '.m',
+  '.mm', '.cu'])
+
+
+def export_compdb(filename, units, fragment_dir=None):
+  """
+  Writes a compilation database in the JSON format of Clang to
+  *filename* (usually ``compile_commands.json``). It contains the
+  commands of the *units* that compile exactly one source file (see
+  :data:`COMPDB_SUFFIXES`). The file is only rewritten if its content
+  changed.
+
+  Args:
+    filename (str): The file to write the database to.
+    units (list of Unit): The units to export the commands of.
+    fragment_dir (str): If specified, the entries of every unit are also
+      written to ``<identifier>.json`` in this directory, which is only
+      rewritten if the entries of the unit changed. If none of these
+      files changed, *filename* is left untouched.
+  """
+
+  directory = os.getcwd()
+  fragments = []
+  names = set()
+  changed = fragment_dir is None
+  for unit in units:
+    buffer = io.StringIO()
+    for target in sorted(unit.targets.values(), key=lambda x: x.name):
+      if not isinstance(target, creator.unit.Target):
+        continue
+      for entry in target.command_data:
+        inputs = entry['inputs']
+        if len(inputs) != 1:
+          continue
+        if os.path.splitext(inputs[0])[1].lower() not in COMPDB_SUFFIXES:
+          continue
+        if buffer.tell():
+          buffer.write(',\n')
+        buffer.write(json.dumps({
+          'directory': directory,
+          'command': entry['command'],
+          'file': inputs[0],
+          'output': entry['outputs'][0],
+        }))
+    fragment = buffer.getvalue()
+    if fragment_dir is not None:
+      name = unit_filename(unit.identifier, '.json')
+      names.add(name)
+      content = '[\n' + fragment + '\n]\n' if fragment else '[]\n'
+      if creator.utils.write_if_changed(
+          os.path.join(fragment_dir, name), content):
+        changed = True
+    if fragment:
+      fragments.append(fragment)
+
+  # Remove the files of units that no longer exist.
+  if fragment_dir is not None and os.path.isdir(fragment_dir):
+    for name in os.listdir(fragment_dir):
+      if name.endswith('.json') and name not in names:
+        os.remove(os.path.join(fragment_dir, name))
+        changed = True
+
+  # The database is the concatenation of the fragments, it is still up
+  # to date if none of them changed since it was written.
+  if not changed:
+    try:
+      mtime = os.stat(filename).st_mtime_ns
+      changed = any(
+        os.stat(os.path.join(fragment_dir, name)).st_mtime_ns > mtime
+        for name in names)
+    except OSError:
+      changed = True
+  if changed:
+    if fragments:
+      content = '[\n' + ',\n'.join(fragments) + '\n]\n'
+    else:
+      content = '[]\n'
+    creator.utils.write_if_changed(filename, content)
+
+
+#: Placeholders for the input and output file that are used to evaluate
+#: the command of :meth:`creator.unit.Target.build_each` only once into
+#: a template that is shared by a single ninja rule.
+IN_PLACEHOLDER = '@creator-in@'
+OUT_PLACEHOLDER = '@creator-out@'
+
+# Matches paths that ninja does not quote when expanding $in and $out.
+if os.name == 'nt':
+  _shell_safe_regex = re.compile(r'^[^\s"]+$')
+else:
+  _shell_safe_regex = re.compile(r'^[A-Za-z0-9_+\-./]+$')
+
+
+def check_template(template, infile, outfile, command):
+  """
+  Checks if *template*, a command evaluated with :data:`IN_PLACEHOLDER`
+  and :data:`OUT_PLACEHOLDER`, results in *command* if the placeholders
+  are replaced by ninja.
+
+  Returns:
+    str: The *template* or None if it can not be used for *command*.
+  """
+
+  if not _shell_safe_regex.match(infile):
+    return None
+  if not _shell_safe_regex.match(outfile):
+    return None
+  result = template.replace(IN_PLACEHOLDER, infile)
+  result = result.replace(OUT_PLACEHOLDER, outfile)
+  if result != command:
+    return None
+  return template
+
+
+def check_rspfile_content(content, inputs):
+  """
+  Returns:
+    bool: True if the response file *content* equals what ninja expands
+    ``$in`` to for the *inputs*.
+  """
+
+  for filename in inputs:
+    if not _shell_safe_regex.match(filename):
+      return False
+  return content == ' '.join(inputs)
+
+
+def unit_filename(identifier, suffix):
+  """
+  Returns the name of the file that the unit *identifier* is exported
+  to in the subninja and compilation database directories. Identifiers
+  that are not valid file names, like those of static units
+  (``static|/path/to/file``), are replaced by :func:`ident` and a hash
+  of the identifier, so that they can not collide with each other.
+
+  Returns:
+    str: A file name without directory.
+  """
+
+  if creator.utils.validate_identifier(identifier):
+    return identifier + suffix
+  digest = hashlib.sha1(identifier.encode('utf8')).hexdigest()[:12]
+  return ident(identifier) + '+' + digest + suffix
+
+
 def ident(s):
   """
   Converts the string *s* into an identifier that is acceptible by
@@ -46,3 +46,102 @@ if (sys.maxsize >> 31) > 0:
     architecture = 'x64'
 else:
     architecture = 'x86'
+
+# The default length of the text passed to $(rsp ...) above which it is
+# moved to a response file. Command lines are limited to 8191 characters
+# by cmd.exe and a single argument to 128 KiB on Linux, which includes
+# the whole command passed to `sh -c`.
+if platform_standard == 'NT':
+  rsp_threshold = 4096
+else:
+  rsp_threshold = 32768
+
+
+def user_cache_dir():
+  """
+  Returns:
+    str: The directory in which *Creator* caches data for the current
+    user. It can be overriden with the ``CREATOR_CACHE_DIR`` environment
+    variable.
+  """
+
+  if os.getenv('CREATOR_CACHE_DIR'):
+    return os.getenv('CREATOR_CACHE_DIR')
+  if platform_standard == 'NT':
+    base = os.getenv('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+    return os.path.join(base, 'creator', 'Cache')
+  if platform_name == 'Darwin':
+    return os.path.expanduser('~/Library/Caches/creator')
+  base = os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+  return os.path.join(base, 'creator')
+
+
+def cpu_count():
+  """
+  Returns:
+    int: The number of CPUs in the system, at least 1.
+  """
+
+  return os.cpu_count() or 1
+
+
+def available_memory():
+  """
+  Returns:
+    int: The physical memory in bytes that is available to new
+    processes without swapping or None if it could not be determined.
+    On Linux this includes the memory the kernel can reclaim from its
+    caches (``MemAvailable`` in ``/proc/meminfo``).
+  """
+
+  if platform_standard == 'NT':
+    import ctypes
+    class MEMORYSTATUSEX(ctypes.Structure):
+      _fields_ = [
+        ('dwLength', ctypes.c_ulong),
+        ('dwMemoryLoad', ctypes.c_ulong),
+        ('ullTotalPhys', ctypes.c_ulonglong),
+        ('ullAvailPhys', ctypes.c_ulonglong),
+        ('ullTotalPageFile', ctypes.c_ulonglong),
+        ('ullAvailPageFile', ctypes.c_ulonglong),
+        ('ullTotalVirtual', ctypes.c_ulonglong),
+        ('ullAvailVirtual', ctypes.c_ulonglong),
+        ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+      ]
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(status)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+      return None
+    return status.ullAvailPhys
+
+  try:
+    with open('/proc/meminfo') as fp:
+      for line in fp:
+        if line.startswith('MemAvailable:'):
+          return int(line.split()[1]) * 1024
+  except (OSError, ValueError, IndexError):
+    pass
+  try:
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+  except (AttributeError, ValueError, OSError):
+    return None
+
+
+def default_pool_depths():
+  """
+  Returns:
+    dict of str -> int: The default depths of the ninja pools ``link``
+    and ``heavy``. A link job is assumed to take up to 2 GiB of memory
+    and a heavy job 1 GiB of the :func:`available_memory`, but neither
+    pool is deeper than the number of CPUs.
+  """
+
+  cpus = cpu_count()
+  memory = available_memory()
+  if memory is None:
+    return {'link': max(1, cpus // 2), 'heavy': cpus}
+  gib = memory // 2 ** 30
+  return {
+    'link': max(1, min(cpus, gib // 2)),
+    'heavy': max(1, min(cpus, gib)),
+  }
@@ -0,0 +1,248 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Runs the tasks and targets specified on the command-line. Tasks may
+depend on targets and other tasks with :meth:`creator.unit.Task.requires`.
+"""
+
+import creator.ninja
+import creator.unit
+import creator.utils
+
+import concurrent.futures
+import subprocess
+import sys
+import time
+import traceback
+
+
+class Result(object):
+  """
+  The outcome of running a task or an invokation of ninja.
+
+  Attributes:
+    name (str): The identifier of the task or the targets passed to
+      ninja, separated by spaces.
+    kind (str): Either ``'task'`` or ``'ninja'``.
+    returncode (int): The exit code of ninja or the code passed to
+      :func:`sys.exit` by the task. It is 1 if the task raised an
+      exception and 0 on success.
+    duration (float): The time it took in seconds.
+  """
+
+  def __init__(self, name, kind, returncode, duration):
+    super().__init__()
+    self.name = name
+    self.kind = kind
+    self.returncode = returncode
+    self.duration = duration
+
+  def __repr__(self):
+    return '<Result {0} {1!r}: {2} in {3:.3f}s>'.format(
+      self.kind, self.name, self.returncode, self.duration)
+
+
+def expand(targets):
+  """
+  Inserts the dependencies of the tasks in *targets* before them. Tasks
+  that are reached as dependencies are contained only once.
+
+  Args:
+    targets (list): A list of :class:`creator.unit.Target` and
+      :class:`creator.unit.Task` objects and full target identifiers.
+  Returns:
+    list: The expanded list of *targets*.
+  Raises:
+    ValueError: If the tasks depend on each other in a cycle.
+  """
+
+  result = []
+  visited = set()
+  stack = []
+
+  def visit(target, is_dep):
+    if isinstance(target, creator.unit.Task):
+      if target in stack:
+        raise ValueError('cyclic task dependency', target.identifier)
+      if is_dep and target in visited:
+        return
+      stack.append(target)
+      for dep in target.dependencies:
+        visit(dep, True)
+      stack.pop()
+      visited.add(target)
+    result.append(target)
+
+  for target in targets:
+    visit(target, False)
+  return result
+
+
+def ident_of(target):
+  """
+  Returns:
+    str: The ninja identifier of the :class:`creator.unit.Target` or
+    full target identifier *target*.
+  """
+
+  if isinstance(target, creator.unit.Target):
+    target = target.identifier
+  return creator.ninja.ident(target)
+
+
+class Scheduler(object):
+  """
+  Runs tasks in a pool of threads while ninja builds the targets. Other
+  than with the sequential processing of the command-line, only the
+  dependencies of the tasks define the order in which things happen.
+  Ninja is invoked with all targets that are pending whenever it is not
+  already running, thus there is only one ninja process at a time.
+
+  Tasks are run in threads since their functions are closures of the
+  unit scripts which can not be passed to other processes.
+
+  Args:
+    ninja_args (list of str): The command to invoke ninja with, without
+      the targets.
+    jobs (int): The number of tasks to run concurrently.
+    log (callable): A function to print status messages with.
+  """
+
+  def __init__(self, ninja_args, jobs, log=print):
+    super().__init__()
+    self.ninja_args = ninja_args
+    self.jobs = jobs
+    self.log = log
+
+  def run(self, targets):
+    """
+    Runs the tasks and builds the targets in *targets*, including the
+    dependencies of the tasks. After a failure no new work is started.
+
+    Args:
+      targets (list): See :func:`expand`.
+    Returns:
+      list of Result: The results in the order of completion.
+    """
+
+    # Map each task to the ninja identifiers and tasks it waits for.
+    pending = []
+    waiting = {}
+    for target in expand(targets):
+      if isinstance(target, creator.unit.Task):
+        idents, tasks = set(), set()
+        for dep in target.dependencies:
+          if isinstance(dep, creator.unit.Task):
+            tasks.add(dep)
+          else:
+            idents.add(ident_of(dep))
+        pending.extend(x for x in sorted(idents) if x not in pending)
+        waiting[target] = (idents, tasks)
+      elif ident_of(target) not in pending:
+        pending.append(ident_of(target))
+
+    built = set()
+    finished = set()
+    results = []
+    futures = {}
+    ninja_running = False
+    failed = False
+
+    # The functions of tasks restored from a snapshot are re-linked
+    # before anything runs, re-linking runs the unit scripts which
+    # modify the macros that the tasks may be evaluating.
+    funcs = {}
+    for task in waiting:
+      try:
+        funcs[task] = task.func
+      except Exception:
+        traceback.print_exc()
+        results.append(Result(task.identifier, 'task', 1, 0.0))
+        failed = True
+
+    with concurrent.futures.ThreadPoolExecutor(self.jobs) as pool, \
+        concurrent.futures.ThreadPoolExecutor(1) as ninja_pool:
+      while True:
+        if not failed:
+          if pending and not ninja_running:
+            future = ninja_pool.submit(self._run_ninja, pending)
+            futures[future] = pending
+            pending = []
+            ninja_running = True
+          for task, (idents, tasks) in list(waiting.items()):
+            if idents <= built and tasks <= finished:
+              del waiting[task]
+              future = pool.submit(self._run_task, task, funcs[task])
+              futures[future] = task
+
+        if not futures:
+          break
+        done, _ = concurrent.futures.wait(futures,
+          return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          item = futures.pop(future)
+          result = future.result()
+          results.append(result)
+          if result.kind == 'ninja':
+            ninja_running = False
+          if result.returncode != 0:
+            failed = True
+          elif result.kind == 'ninja':
+            built.update(item)
+          else:
+            finished.add(item)
+
+    return results
+
+  def _run_ninja(self, idents):
+    """
+    Private. Invokes ninja for the targets *idents*.
+    """
+
+    args = self.ninja_args + idents
+    self.log("running: " + ' '.join(creator.utils.quote(x) for x in args))
+    start = time.perf_counter()
+    returncode = subprocess.call(args)
+    duration = time.perf_counter() - start
+    return Result(' '.join(idents), 'ninja', returncode, duration)
+
+  def _run_task(self, task, func):
+    """
+    Private. Runs the function *func* of *task* and catches any
+    exception it raises.
+    """
+
+    self.log("running task '{0}'".format(task.identifier))
+    start = time.perf_counter()
+    try:
+      func()
+      returncode = 0
+    except SystemExit as exc:
+      if exc.code is None or isinstance(exc.code, int):
+        returncode = exc.code or 0
+      else:
+        print(exc.code, file=sys.stderr)
+        returncode = 1
+    except Exception:
+      traceback.print_exc()
+      returncode = 1
+    duration = time.perf_counter() - start
+    return Result(task.identifier, 'task', returncode, duration)
@@ -0,0 +1,288 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+A snapshot is the state of a :class:`creator.unit.Workspace` after all
+units have been loaded and all targets have been set up. It is saved
+next to the :class:`creator.manifest.Manifest` and allows running
+tasks without executing the unit scripts while the manifest is up to
+date.
+
+Python functions can not be saved. The functions of tasks and the
+:class:`creator.macro.Function` macros defined by unit scripts are
+re-linked lazily by executing the unit script again with
+:meth:`creator.unit.Unit.relink` when they are first used.
+"""
+
+import creator
+import creator.macro
+import creator.unit
+import creator.utils
+
+import io
+import os
+import pickle
+import sys
+import weakref
+
+
+class SnapshotError(Exception):
+  pass
+
+
+class LinkFunction(creator.macro.Function):
+  """
+  Placeholder for a :class:`creator.macro.Function` macro that has been
+  defined by a unit script. The Python function is re-linked when it is
+  accessed for the first time.
+
+  Args:
+    workspace (creator.unit.Workspace): The restored workspace.
+    name (str): The full name of the macro.
+  """
+
+  def __init__(self, workspace, name):
+    self._workspace = weakref.ref(workspace)
+    self._name = name
+    super().__init__(None, pure=False)
+
+  @property
+  def name(self):
+    return self._name
+
+  @property
+  def func(self):
+    if self._func is None:
+      self._func = relink_function(self._workspace(), self._name)
+    return self._func
+
+  @func.setter
+  def func(self, func):
+    self._func = func
+
+
+def relink_function(workspace, name):
+  """
+  Re-links the :class:`creator.macro.Function` macro *name* by running
+  the unit script that defines it again. Macros without a namespace
+  could have been defined by any unit, thus all units are tried.
+
+  Returns:
+    callable: The Python function of the macro.
+  Raises:
+    SnapshotError: If no unit defines the function.
+  """
+
+  namespace, varname = creator.utils.parse_var(name)
+  if namespace in workspace.units:
+    units = [workspace.units[namespace]]
+  else:
+    units = list(workspace.statics.values()) + list(workspace.units.values())
+  for unit in units:
+    node = unit.relink().get(name)
+    if isinstance(node, creator.macro.Function) and \
+        not isinstance(node, LinkFunction):
+      return node.func
+  raise SnapshotError('function macro could not be re-linked', name)
+
+
+class _Pickler(pickle.Pickler):
+  """
+  Private. Pickles macro expression trees and replaces the contexts
+  and functions in them with references.
+  """
+
+  def __init__(self, fp, workspace):
+    super().__init__(fp, pickle.HIGHEST_PROTOCOL)
+    self.workspace = workspace
+    self.functions = {}
+    for key, node in workspace.context.macros.items():
+      if isinstance(node, creator.macro.Function):
+        self.functions[id(node)] = key
+
+  def persistent_id(self, obj):
+    if isinstance(obj, weakref.ref):
+      return ('ref', self.persistent_id(obj()))
+    elif isinstance(obj, creator.macro.ContextProvider):
+      if obj is self.workspace.context:
+        return ('workspace',)
+      elif isinstance(obj, creator.unit.UnitContext):
+        return ('unit', obj.unit.identifier)
+      raise pickle.PicklingError('unsupported context', type(obj))
+    elif isinstance(obj, creator.macro.Function):
+      name = obj.name
+      if creator.macro.Globals.functions.get(name) is obj:
+        return ('global', name)
+      elif id(obj) in self.functions:
+        return ('function', self.functions[id(obj)])
+      raise pickle.PicklingError('unsupported function', name)
+    return None
+
+
+class _Unpickler(pickle.Unpickler):
+  """
+  Private. Counterpart of :class:`_Pickler`.
+  """
+
+  def __init__(self, fp, workspace):
+    super().__init__(fp)
+    self.workspace = workspace
+
+  def persistent_load(self, pid):
+    kind = pid[0]
+    if kind == 'ref':
+      return weakref.ref(self.persistent_load(pid[1]))
+    elif kind == 'workspace':
+      return self.workspace.context
+    elif kind == 'unit':
+      ident = pid[1]
+      if ident.startswith('static|'):
+        return self.workspace.statics[ident[len('static|'):]].context
+      return self.workspace.units[ident].context
+    elif kind == 'global':
+      return creator.macro.Globals.functions[pid[1]]
+    elif kind == 'function':
+      return LinkFunction(self.workspace, pid[1])
+    raise pickle.UnpicklingError('unsupported persistent id', pid)
+
+
+def _dump_unit(unit):
+  """
+  Private. Returns the data of *unit* for the snapshot.
+  """
+
+  targets = []
+  for target in unit.targets.values():
+    if isinstance(target, creator.unit.Task):
+      deps = [dep.identifier for dep in target.dependencies]
+      targets.append(('task', target.name, None, deps))
+    else:
+      deps = [dep.identifier for dep in target.dependencies]
+      targets.append(('target', target.name, target.command_data, deps))
+  return {
+    'identifier': unit.identifier,
+    'project_path': unit.project_path,
+    'filename': unit.scope.get('__file__'),
+    'aliases': dict(unit.aliases),
+    'targets': targets,
+  }
+
+
+def _load_unit(workspace, data):
+  """
+  Private. Creates a :class:`creator.unit.Unit` in *workspace* from the
+  *data* returned by :func:`_dump_unit`. The dependencies of the
+  targets are resolved by :func:`load`, the ones of the tasks when
+  they are requested.
+  """
+
+  unit = creator.unit.Unit(data['project_path'], data['identifier'], workspace)
+  unit.aliases = data['aliases']
+  if data['filename']:
+    unit.scope['__file__'] = data['filename']
+  for kind, name, command_data, deps in data['targets']:
+    if kind == 'task':
+      task = creator.unit.Task(unit, name, None)
+      for ident in deps:
+        task.requires(ident)
+      unit.targets[name] = task
+    else:
+      target = creator.unit.Target(unit, name)
+      target.command_data = command_data
+      target.is_setup = True
+      unit.targets[name] = target
+  return unit
+
+
+def save(filename, workspace, key):
+  """
+  Saves a snapshot of the *workspace* to *filename*. The snapshot can
+  only be loaded with the same *key*, usually the
+  :meth:`creator.manifest.Manifest.fingerprint`. If the workspace can
+  not be saved, eg. because a macro is bound to a context that is not
+  part of the workspace, an existing snapshot is removed.
+
+  Returns:
+    bool: True if the snapshot was saved, False if not.
+  """
+
+  fp = io.BytesIO()
+  try:
+    data = {
+      'path': workspace.path,
+      'statics': [_dump_unit(u) for u in workspace.statics.values()],
+      'units': [_dump_unit(u) for u in workspace.units.values()],
+    }
+    pickle.dump([creator.__version__, sys.version, key], fp)
+    pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+    _Pickler(fp, workspace).dump(workspace.context.macros)
+  except (pickle.PicklingError, TypeError, ValueError, AttributeError):
+    try:
+      os.remove(filename)
+    except OSError:
+      pass
+    return False
+  creator.utils.write_atomic(filename, fp.getvalue())
+  return True
+
+
+def load(filename, key):
+  """
+  Loads a snapshot that has been saved with :func:`save`.
+
+  Returns:
+    creator.unit.Workspace: The restored workspace or None if there is
+    no snapshot, it is corrupt or the *key* does not match.
+  """
+
+  try:
+    with open(filename, 'rb') as fp:
+      if pickle.load(fp) != [creator.__version__, sys.version, key]:
+        return None
+      data = pickle.load(fp)
+      workspace = creator.unit.Workspace(load_profile=False)
+      workspace.path = data['path']
+      units = {}
+      for unit_data in data['statics'] + data['units']:
+        unit = _load_unit(workspace, unit_data)
+        units[unit.identifier] = unit
+        if unit.is_static():
+          workspace.statics[unit.identifier[len('static|'):]] = unit
+        else:
+          workspace.units[unit.identifier] = unit
+      for unit_data in data['statics'] + data['units']:
+        unit = units[unit_data['identifier']]
+        for kind, name, command_data, deps in unit_data['targets']:
+          if kind == 'task':
+            continue
+          for ident in deps:
+            namespace, varname = creator.utils.parse_var(ident)
+            dep = units[namespace].targets[varname]
+            unit.targets[name].dependencies.append(dep)
+      macros = _Unpickler(fp, workspace).load()
+  except (OSError, EOFError, pickle.UnpicklingError, KeyError, ValueError,
+      TypeError, AttributeError):
+    return None
+
+  workspace.context.macros.clear()
+  workspace.context.macros.update(macros)
+  for name in macros:
+    workspace.context.changed(name)
+  return workspace
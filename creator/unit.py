@@ -20,11 +20,18 @@
 
 import creator.macro
 import creator.ninja
+import creator.platform
 import creator.utils
+import hashlib
+import importlib.util
+import marshal
 import os
 import shlex
+import struct
 import subprocess
 import sys
+import threading
+import time
 import warnings
 import weakref
 
@@ -35,11 +42,57 @@ class UnitNotFoundError(Exception):
   pass
 
 
+def compile_unit_script(filename):
+  """
+  Compiles the unit script at *filename* into a code object. The code
+  object is cached in the :func:`creator.platform.user_cache_dir` and
+  reused as long as the modification time and size of the file and the
+  Python version don't change.
+
+  Returns:
+    code: The code object of the unit script.
+  """
+
+  st = os.stat(filename)
+  key = hashlib.sha1(filename.encode('utf8')).hexdigest()
+  cache_file = os.path.join(creator.platform.user_cache_dir(), 'units', key)
+  header = importlib.util.MAGIC_NUMBER
+  header += struct.pack('<qq', st.st_mtime_ns, st.st_size)
+
+  try:
+    with open(cache_file, 'rb') as fp:
+      data = fp.read()
+  except OSError:
+    data = b''
+  if data.startswith(header):
+    try:
+      return marshal.loads(data[len(header):])
+    except (EOFError, ValueError, TypeError):
+      pass
+
+  with open(filename) as fp:
+    code = compile(fp.read(), filename, 'exec', dont_inherit=True)
+
+  # Files that have been modified just now could change again without
+  # their modification time changing, don't cache them yet.
+  if not sys.dont_write_bytecode and time.time_ns() - st.st_mtime_ns > 2e9:
+    try:
+      creator.utils.write_atomic(cache_file, header + marshal.dumps(code))
+    except OSError:
+      pass
+  return code
+
+
 class Workspace(object):
   """
   The *Workspace* is basically the root of a *Creator* build session.
   It manages loading unit scripts and contains the global macro context.
 
+  Args:
+    load_profile (bool): Execute the users ``.creator_profile``. This
+      is False when the workspace is restored from a snapshot (see
+      :mod:`creator.snapshot`).
+
   Attributes:
     path (list of str): A list of directory names in which unit scripts
       are being searched for. The unit scripts will actually also be
@@ -49,22 +102,29 @@ class Workspace(object):
       identifier of a :class:`Unit` to the actual object.
     statics (dict of str -> Unit): A dictionary that maps the full
       normalized filenames of static creator files.
+    profile (str): The full normalized filename of the users
+      ``.creator_profile``, whether it exists or not.
+    unit_index (creator.utils.DirectoryIndex): The directory listings
+      of the search :attr:`path` used by :meth:`find_unit`.
   """
 
-  def __init__(self):
+  def __init__(self, load_profile=True):
     super().__init__()
-    self.path = ['.']
-    self.path.append(os.path.join(os.path.dirname(__file__), 'builtins'))
-    self.path.extend(os.getenv('CREATORPATH', '').split(os.pathsep))
+    self.path = self.default_path()
     self.context = WorkspaceContext(self)
     self.units = {}
     self.statics = {}
+    self.unit_index = creator.utils.DirectoryIndex()
+    self._unit_files = {}
+    self._indexed_path = ()
+    self._indexed_count = 0
 
     # If the current user has a `.creator_profile` file in his
     # home directory, run that file.
     filename = os.path.join(os.path.expanduser('~'), '.creator_profile')
     filename = creator.utils.normpath(filename)
-    if os.path.isfile(filename):
+    self.profile = filename
+    if load_profile and os.path.isfile(filename):
       unit = Unit(os.path.dirname(filename), 'static|' + filename, self)
       self.statics[filename] = unit
       try:
@@ -73,6 +133,20 @@ class Workspace(object):
         del self.statics[filename]
         raise
 
+  @staticmethod
+  def default_path():
+    """
+    Returns:
+      list of str: The unit search path a new workspace starts with,
+      the current directory, the built-in unit scripts and the
+      directories in the ``CREATORPATH`` environment variable.
+    """
+
+    path = ['.']
+    path.append(os.path.join(os.path.dirname(__file__), 'builtins'))
+    path.extend(os.getenv('CREATORPATH', '').split(os.pathsep))
+    return path
+
   def get_unit(self, identifier):
     """
     Returns:
@@ -87,7 +161,10 @@ class Workspace(object):
 
   def find_unit(self, identifier):
     """
-    Searches for the filename of a unit in the search :attr:`path`.
+    Searches for the filename of a unit in the search :attr:`path`. The
+    unit scripts in the search path are indexed directory by directory
+    as far as necessary to find the unit. The index is rebuilt when the
+    search path changed.
 
     Args:
       identifier (str): The identifier of the unit to load.
@@ -97,19 +174,40 @@ class Workspace(object):
       UnitNotFoundError: If the unit could not be found.
     """
 
-    filename = identifier + '.crunit'
-    for dirname in self.path:
-      if not os.path.isdir(dirname):
-        continue
-      path = os.path.join(dirname, filename)
-      if os.path.isfile(path):
-        return path
-      for item in os.listdir(dirname):
-        path = os.path.join(dirname, item, filename)
-        if os.path.isfile(path):
-          return path
+    path = tuple(self.path)
+    if path != self._indexed_path:
+      self._unit_files = {}
+      self._indexed_path = path
+      self._indexed_count = 0
 
-    raise UnitNotFoundError(identifier)
+    filename = self._unit_files.get(identifier)
+    while filename is None and self._indexed_count < len(path):
+      self._index_unit_dir(path[self._indexed_count])
+      self._indexed_count += 1
+      filename = self._unit_files.get(identifier)
+
+    if filename is None:
+      raise UnitNotFoundError(identifier)
+    return filename
+
+  def _index_unit_dir(self, dirname):
+    """
+    Private. Adds the unit scripts in *dirname* and its subdirectories
+    to the index of :meth:`find_unit`. Units that are already in the
+    index take precedence, as do the scripts directly in *dirname* over
+    the ones in its subdirectories.
+    """
+
+    listdir = self.unit_index.listdir
+    dirs, files, links = listdir(dirname)
+    for name in files:
+      if name.endswith('.crunit'):
+        self._unit_files.setdefault(name[:-7], os.path.join(dirname, name))
+    for item in dirs:
+      subdir = os.path.join(dirname, item)
+      for name in listdir(subdir)[1]:
+        if name.endswith('.crunit'):
+          self._unit_files.setdefault(name[:-7], os.path.join(subdir, name))
 
   def load_unit(self, identifier):
     """
@@ -150,6 +248,57 @@ class Workspace(object):
           target.do_setup()
 
 
+class AliasMap(dict):
+  """
+  The dictionary for :attr:`Unit.aliases` that calls the bound method
+  *on_change* when it is modified. Only a weak reference to the method
+  is kept.
+  """
+
+  def __init__(self, mapping, on_change):
+    super().__init__(mapping)
+    self._on_change = weakref.WeakMethod(on_change)
+
+  def _changed(self):
+    on_change = self._on_change()
+    if on_change is not None:
+      on_change()
+
+  def __setitem__(self, key, value):
+    super().__setitem__(key, value)
+    self._changed()
+
+  def __delitem__(self, key):
+    super().__delitem__(key)
+    self._changed()
+
+  def clear(self):
+    super().clear()
+    self._changed()
+
+  def pop(self, *args):
+    try:
+      return super().pop(*args)
+    finally:
+      self._changed()
+
+  def popitem(self):
+    try:
+      return super().popitem()
+    finally:
+      self._changed()
+
+  def setdefault(self, key, default=None):
+    try:
+      return super().setdefault(key, default)
+    finally:
+      self._changed()
+
+  def update(self, *args, **kwargs):
+    super().update(*args, **kwargs)
+    self._changed()
+
+
 class Unit(object):
   """
   A *Unit* represents a collection of macros and build targets. Each
@@ -177,6 +326,10 @@ class Unit(object):
       script is being executed.
   """
 
+  # Re-linking runs unit scripts which modify the macros of the
+  # workspace, thus only one unit is re-linked at a time.
+  _relink_lock = threading.RLock()
+
   def __init__(self, project_path, identifier, workspace):
     super().__init__()
     self.project_path = project_path
@@ -186,6 +339,8 @@ class Unit(object):
     self.targets = {}
     self.context = UnitContext(self)
     self.scope = self._create_scope()
+    self._relinking = False
+    self._relinked = None
 
   def _create_scope(self):
     """
@@ -233,6 +388,24 @@ class Unit(object):
       if not creator.utils.validate_identifier(identifier):
         raise ValueError('invalid unit identifier', identifier)
     self._identifier = identifier
+    self._names_changed()
+
+  def get_aliases(self):
+    return self._aliases
+
+  def set_aliases(self, aliases):
+    self._aliases = AliasMap(aliases, self._names_changed)
+    self._names_changed()
+
+  def _names_changed(self):
+    """
+    Private. Called when the identifier or the aliases of the unit
+    change, see :meth:`UnitContext.names_changed`.
+    """
+
+    context = self.__dict__.get('context')
+    if context is not None:
+      context.names_changed()
 
   def get_workspace(self):
     return self._workspace()
@@ -268,16 +441,58 @@ class Unit(object):
     Executes the Python unit script at *filename* for this unit.
     """
 
-    with open(filename) as fp:
-      code = compile(fp.read(), filename, 'exec', dont_inherit=True)
+    code = compile_unit_script(filename)
     self.scope['__file__'] = filename
     self.scope['__name__'] = '__crunit__'
     exec(code, self.scope)
 
+  def relink(self):
+    """
+    Executes the unit script again to restore the Python functions of
+    a unit that has been restored from a snapshot (see
+    :mod:`creator.snapshot`). The existing targets and tasks are reused
+    and the tasks are bound to their new functions. Any changes the
+    script makes to the macros are reverted. The script is executed
+    only once, units are re-linked one at a time.
+
+    Returns:
+      dict of str -> ExpressionNode: The macros of the workspace as
+      they were left by the unit script.
+    """
+
+    with self._relink_lock:
+      if self._relinked is not None:
+        return self._relinked
+      filename = self.scope.get('__file__')
+      if not filename or self._relinking:
+        return {}
+
+      context = self.workspace.context
+      macros = context.macros
+      saved = dict(macros)
+      self._relinking = True
+      self.scope = self._create_scope()
+      try:
+        self.run_unit_script(filename)
+        self._relinked = dict(macros)
+      finally:
+        self._relinking = False
+        # Only the macros the script changed are restored, the others
+        # stay accessible while the script is running.
+        for name in set(macros).union(saved):
+          if macros.get(name) is not saved.get(name):
+            if name in saved:
+              macros[name] = saved[name]
+            else:
+              del macros[name]
+            context.changed(name)
+    return self._relinked
+
   def is_static(self):
     return self._identifier.startswith('static|')
 
   identifier = property(get_identifier, set_identifier)
+  aliases = property(get_aliases, set_aliases)
   workspace = property(get_workspace, set_workspace)
 
   def run_task(self, task_name):
@@ -306,8 +521,7 @@ class Unit(object):
     return task.func()
 
   def append(self, name, value):
-    # todo: This is a rather dirty implementation. :-)
-    self.define(name, '${' + name + '}' + value)
+    self.context.append(name, value)
 
   def confirm(self, text, stack_depth=0):
     """
@@ -367,20 +581,74 @@ class Unit(object):
       str: The result of the evaluation.
     """
 
+    context = self._create_context(supp_context, stack_depth)
+
+    # Parse without binding to the temporary context so the expression
+    # tree can be served from the parse cache next time.
+    macro = creator.macro.parse(text, None)
+    with creator.macro.EvalSession.enter():
+      return macro.eval(context, [])
+
+  def eval_list(self, text, supp_context=None, stack_depth=0):
+    """
+    Like :meth:`eval`, but returns the result as a list. This is faster
+    than splitting the result of :meth:`eval` if the macro evaluates to
+    a list value (eg. the result of ``$(wildcard ...)``).
+
+    Returns:
+      list of str: The result of the evaluation.
+    """
+
+    context = self._create_context(supp_context, stack_depth)
+    macro = creator.macro.parse(text, None)
+    with creator.macro.EvalSession.enter():
+      return creator.macro.to_list(macro.eval_value(context, []))
+
+  def compile(self, text, supp_context=None, stack_depth=0):
+    """
+    Like :meth:`eval`, but parses and compiles *text* only once and
+    returns a function that evaluates it when called. This is useful
+    when the same macro must be evaluated many times while only the
+    contents of *supp_context* change.
+
+    Args:
+      text (str): The text to compile.
+      supp_context (creator.macro.ContextProvider): See :meth:`eval`.
+      stack_depth (int): See :meth:`eval`.
+    Returns:
+      callable: A function that takes no arguments and returns the
+        result of the evaluation as a string.
+    """
+
+    context = self._create_context(supp_context, stack_depth)
+    func = creator.macro.parse(text, None).compile()
+    def evaluate():
+      with creator.macro.EvalSession.enter():
+        return func(context, [])
+    return evaluate
+
+  def _create_context(self, supp_context, stack_depth):
+    """
+    Private. Creates the context for :meth:`eval`, :meth:`eval_list`
+    and :meth:`compile`. *stack_depth* is relative to the frame that
+    called one of these methods.
+    """
+
     context = creator.macro.ChainContext(self.context)
     if stack_depth >= 0:
-      sf_context = creator.macro.StackFrameContext(stack_depth + 1)
+      sf_context = creator.macro.StackFrameContext(stack_depth + 2)
       context.contexts.insert(0, sf_context)
     if supp_context is not None:
       context.contexts.insert(0, supp_context)
-    macro = creator.macro.parse(text, context)
-    return macro.eval(context, [])
+    return context
 
   def extends(self, identifier):
     """
     Loads all the contents of the Unit with the specified *identifier*
-    into the scope of this Unit and substitutes the context references
-    in the original macros with the context of this unit.
+    into the scope of this Unit. The variables in the original macros
+    are resolved in the context of this unit. The macros share their
+    expression trees with the original unit (see
+    :class:`creator.macro.ContextSwitchNode`).
 
     Args:
       identifier (str): The name of the unit to inherit from.
@@ -401,8 +669,9 @@ class Unit(object):
       "Target.build_each() instead", DeprecationWarning)
 
     eval = self.eval
-    inputs = creator.utils.split(eval(inputs, stack_depth=stack_depth + 1))
-    outputs = creator.utils.split(eval(outputs, stack_depth=stack_depth + 1))
+    split = creator.utils.iter_split
+    inputs = split(eval(inputs, stack_depth=stack_depth + 1))
+    outputs = split(eval(outputs, stack_depth=stack_depth + 1))
     return zip(inputs, outputs)
 
   def info(self, *args, **kwargs):
@@ -486,24 +755,40 @@ class Unit(object):
 
     if not callable(func):
       raise TypeError('func must be callable', type(func))
+    if self._relinking and isinstance(self.targets.get(func.__name__), Target):
+      return self.targets[func.__name__]
     if func.__name__ in self.targets:
       raise ValueError('target "{0}" already exists'.format(func.__name__))
     target = Target(self, func.__name__, func, False)
     self.targets[func.__name__] = target
     return target
 
-  def task(self, func):
+  def task(self, func=None, requires=()):
     """
     Decorator for Python functions which can be invoked from the Creator
     command-line as tasks. The name of the function is used as task name.
     The task is internally registered in the :attr:`targets` dictionary.
+
+    The targets and tasks that must be built and run before the task
+    can be specified with ``@task(requires=[...])``, see
+    :meth:`Task.requires`.
     """
 
+    if func is None:
+      return lambda func: self.task(func, requires)
+    if isinstance(requires, str):
+      requires = [requires]
     if not callable(func):
       raise TypeError('func must be callable', type(func))
+    if self._relinking and isinstance(self.targets.get(func.__name__), Task):
+      self.targets[func.__name__]._func = func
+      return func
     if func.__name__ in self.targets:
       raise ValueError('task name already reserved', func.__name__)
-    self.targets[func.__name__] = Task(self, func.__name__, func)
+    task = Task(self, func.__name__, func)
+    for target in requires:
+      task.requires(target)
+    self.targets[func.__name__] = task
     return func
 
 
@@ -532,6 +817,10 @@ class Target(object):
     identifier (str): The identifier of the target, which is the
       units identifier and the targets name concatenated.
     is_setup (bool): True if the target is set-up, False if not.
+    pool (str): The name of the ninja pool that the commands of the
+      target are run in, unless :meth:`build` specifies one. The depth
+      of a pool is taken from the ``$pool.<name>`` macro, see
+      :func:`creator.ninja.export`.
     on_setup (callable)
     pass_self (bool)
     args (any)
@@ -548,7 +837,8 @@ class Target(object):
       no data for this event.
     - ``'build'``: Sent when :meth:`build` is called. The data for
       this event is a dictionary ``{'inputs': str, 'outputs': str,
-        'command': str, 'auxiliary': [], 'each': bool}``. The listener
+        'command': str, 'auxiliary': [], 'each': bool, 'depfile': str,
+        'deps': str, 'pool': str}``. The listener
         is allowed to modify the event data. The auxiliary list can be
         filled with a list of files that are taken as additional
         dependencies.
@@ -569,6 +859,7 @@ class Target(object):
     self._unit = weakref.ref(unit)
     self._name = name
     self.is_setup = False
+    self.pool = None
     self.dependencies = []
     self.on_setup = on_setup
     self.pass_self = pass_self
@@ -642,7 +933,8 @@ class Target(object):
     kwargs.setdefault('stack_depth', 1)
     return self.build(*args, **kwargs)
 
-  def build(self, inputs, outputs, command, each=False, stack_depth=0):
+  def build(self, inputs, outputs, command, each=False, depfile=None,
+      deps=None, pool=None, stack_depth=0):
     """
     Associated the *inputs* with the *outputs* being built by the
     specified *\*commands*. All parameters passed to this function must
@@ -654,16 +946,40 @@ class Target(object):
     - ``'inputs'``: A list of input files.
     - ``'outputs'``: A list of output files.
     - ``'command'``: A command to produce the output files.
+    - ``'template'``: The command with placeholders for the input and
+      output file if it can be exported as a shared ninja rule, or None.
+      See :func:`creator.ninja.check_template`.
+    - ``'depfile'``: The dependency file written by the command or None.
+    - ``'deps'``: The format of the dependency information for ninja
+      or None.
+    - ``'rspfile'``: The response file of the command or None.
+    - ``'rspfile_content'``: The content of the response file or None.
+    - ``'pool'``: The name of the ninja pool to run the command in or
+      None to use the :attr:`pool` of the target.
+
+    Text passed to ``$(rsp ...)`` in the *command* is moved to a response
+    file next to the first output file if it is longer than
+    ``$RspThreshold`` characters (see :class:`creator.macro.ResponseFile`).
+    The response file is written by ninja before the command is run.
 
     Args:
       inputs (str): A listing of the input files.
       outputs (str): A listing of the output files.
       command (str): A command to build the outputs from the inputs. The
         special variables `$<` and `$@` represent the input and output.
-        The variables `$in` and `$out` will automatically be escaped so
-        they will be exported to the ninja rule.
-      each (bool): If True, the files will be built each on its own,
-        but it expects the caller to use the ``$in`` and ``$out`` macros.
+      each (bool): If True, the files will be built each on its own. If
+        the command only differs in `$<` and `$@` for every file, all of
+        them share the same rule in the exported ninja file.
+      depfile (str): The Makefile style dependency file that the command
+        writes the header files it read to, eg. ``'${@}.d'``. Evaluated
+        like the *command*. Ninja rebuilds the outputs if any of these
+        files changes.
+      deps (str): ``'gcc'`` or ``'msvc'`` to make ninja move the
+        dependency information into its ``.ninja_deps`` log after the
+        command finished, see the ``$deps`` macro of the compiler units.
+      pool (str): The name of the ninja pool to run the commands in,
+        eg. ``'link'``. Ninja limits the number of commands that run in
+        the same pool at a time.
     """
 
     stack_depth += 1
@@ -674,56 +990,99 @@ class Target(object):
     data = {
       'inputs': inputs, 'outputs': outputs,
       'command': command, 'auxiliary': [], 'each': each,
+      'depfile': depfile, 'deps': deps, 'pool': pool,
     }
-    del inputs, outputs, command
+    del inputs, outputs, command, depfile, deps, pool
     for listener in self.listeners:
       listener(self, 'build', data)
 
-    # Evaluate and split the input files into a list.
-    input_files = creator.utils.split(self.unit.eval(
-      data['inputs'], stack_depth=stack_depth))
+    # Evaluate the input and output files into lists.
+    input_files = self.unit.eval_list(data['inputs'], stack_depth=stack_depth)
     input_files = [creator.utils.normpath(f) for f in input_files]
-
-    # Evaluate and split the output files into a list.
-    output_files = creator.utils.split(self.unit.eval(
-      data['outputs'], stack_depth=stack_depth))
+    output_files = self.unit.eval_list(data['outputs'], stack_depth=stack_depth)
     output_files = [creator.utils.normpath(f) for f in output_files]
 
     context = creator.macro.MutableContext()
+    deps = None
+    if data['deps']:
+      deps = self.unit.eval(data['deps'], stack_depth=stack_depth).strip() or None
+    threshold = self.unit.eval('$RspThreshold', stack_depth=-1).strip()
+    threshold = int(threshold) if threshold else sys.maxsize
+    ResponseFile = creator.macro.ResponseFile
 
     if each:
       if len(input_files) != len(output_files):
         raise ValueError('input file count must match output file count')
-      for fin, fout in zip(input_files, output_files):
-        context['<'] = raw(fin)
-        context['@'] = raw(fout)
-        command = self.unit.eval(data['command'], context, stack_depth=stack_depth)
-        self.command_data.append({
-          'inputs': [fin],
-          'outputs': [fout],
-          'auxiliary': data['auxiliary'],
-          'command': command,
-        })
+      # The command is the same for every file, only the values of $<
+      # and $@ change, thus we compile it only once.
+      command = self.unit.compile(data['command'], context, stack_depth=stack_depth)
+      depfile = None
+      if data['depfile']:
+        depfile = self.unit.compile(data['depfile'], context, stack_depth=stack_depth)
+      context['<'] = raw(creator.ninja.IN_PLACEHOLDER)
+      context['@'] = raw(creator.ninja.OUT_PLACEHOLDER)
+      # Values that do not depend on $< and $@ are evaluated only once
+      # for all files.
+      with creator.macro.EvalSession.enter(watch=('<', '@')):
+        with ResponseFile(creator.ninja.OUT_PLACEHOLDER + '.rsp', threshold):
+          template = command()
+        for fin, fout in zip(input_files, output_files):
+          context['<'] = raw(fin)
+          context['@'] = raw(fout)
+          with ResponseFile(fout + '.rsp', threshold) as rspfile:
+            real_command = command()
+          self.command_data.append({
+            'inputs': [fin],
+            'outputs': [fout],
+            'auxiliary': data['auxiliary'],
+            'command': real_command,
+            'template': creator.ninja.check_template(
+              template, fin, fout, real_command),
+            'depfile': (depfile().strip() or None) if depfile else None,
+            'deps': deps,
+            'rspfile': rspfile.filename if rspfile.content else None,
+            'rspfile_content': ' '.join(rspfile.content) or None,
+            'pool': data['pool'],
+          })
     else:
-      context['<'] = raw(creator.utils.join(input_files))
-      context['@'] = raw(creator.utils.join(output_files))
-      command = self.unit.eval(data['command'], context, stack_depth=stack_depth)
+      context['<'] = creator.macro.ListNode(input_files)
+      context['@'] = creator.macro.ListNode(output_files)
+      filename = (output_files[0] if output_files else '') + '.rsp'
+      with ResponseFile(filename, threshold) as rspfile:
+        command = self.unit.eval(data['command'], context, stack_depth=stack_depth)
+      depfile = None
+      if data['depfile']:
+        depfile = self.unit.eval(data['depfile'], context, stack_depth=stack_depth)
       self.command_data.append({
         'inputs': input_files,
         'outputs': output_files,
         'auxiliary': data['auxiliary'],
         'command': command,
+        'template': None,
+        'depfile': (depfile.strip() or None) if depfile else None,
+        'deps': deps,
+        'rspfile': rspfile.filename if rspfile.content else None,
+        'rspfile_content': ' '.join(rspfile.content) or None,
+        'pool': data['pool'],
       })
 
-  def build_each(self, inputs, outputs, command, stack_depth=0):
+  def build_each(self, inputs, outputs, command, depfile=None, deps=None,
+      pool=None, stack_depth=0):
     stack_depth += 1
-    return self.build(inputs, outputs, command, each=True, stack_depth=stack_depth)
+    return self.build(inputs, outputs, command, each=True, depfile=depfile,
+      deps=deps, pool=pool, stack_depth=stack_depth)
 
-  def export(self, writer):
+  def export(self, writer, rules=None):
     """
     Export the target to the ninja file using the *writer*. The target
     and all its dependencies must be set-up.
 
+    Args:
+      writer (ninja_syntax.Writer): The writer to export to.
+      rules (dict of tuple -> str): A mapping of the rule commands and
+        their options to the names of the rules that have already been
+        written. Pass the same dict for all targets exported to the same
+        file so they can share rules.
     Raises:
       RuntimeError: If the target or one of its dependencies is not set-up.
     """
@@ -735,26 +1094,91 @@ class Target(object):
 
     # The outputs of depending targets must be listed additionally
     # to the actual input files of this target, otherwise ninja can
-    # not know the targets depend on each other.
-    infiles = set()
+    # not know the targets depend on each other. The phony target of
+    # the dependency is listed instead of all of its outputs. Targets
+    # without outputs are skipped as ninja would consider their phony
+    # target to be always out of date.
+    infiles = []
 
     for dep in self.dependencies:
       if not dep.is_setup:
         raise RuntimeError('target "{0}" not set-up'.format(dep.identifier))
-      for entry in dep.command_data:
-        infiles |= set(map(creator.utils.normpath, entry['outputs']))
+      if any(entry['outputs'] for entry in dep.command_data):
+        phony = creator.ninja.ident(dep.identifier)
+        if phony not in infiles:
+          infiles.append(phony)
 
-    infiles = list(infiles)
     phonies = []
-
-    for index, entry in enumerate(self.command_data):
-      rule_name = self.identifier + '_{0:04d}'.format(index)
-      rule_name = creator.ninja.ident(rule_name)
-      writer.rule(rule_name, entry['command'])
+    if rules is None:
+      rules = {}
+    rule_count = 0
+
+    for entry in self.command_data:
+      # Commands that follow a template share one rule that uses $in
+      # and $out. Other commands are passed to a generic rule as a
+      # variable, unless they contain a $ which would be expanded in
+      # the scope of the build statement instead of the rule.
+      variables = None
+      deps = entry.get('deps')
+      if entry.get('template') is not None:
+        command = entry['template']
+        command = command.replace(creator.ninja.IN_PLACEHOLDER, '$in')
+        command = command.replace(creator.ninja.OUT_PLACEHOLDER, '$out')
+      elif '$' not in entry['command']:
+        command = '$command'
+        variables = {'command': entry['command']}
+      else:
+        command = entry['command']
+
+      # If the response file contains just the input files, the rule
+      # writes $in to it instead of repeating them in a variable.
+      rsp_in = False
+      if entry.get('rspfile'):
+        rsp_in = creator.ninja.check_rspfile_content(
+          entry['rspfile_content'], entry['inputs'])
+
+      key = (command, deps, rsp_in)
+      rule_name = rules.get(key)
+      if rule_name is None:
+        if variables is not None:
+          rule_name = 'creator_command'
+          if deps:
+            rule_name += '_' + deps
+          if rsp_in:
+            rule_name += '_rsp'
+          rule_name = creator.ninja.ident(rule_name)
+        else:
+          rule_name = self.identifier + '_{0:04d}'.format(rule_count)
+          rule_name = creator.ninja.ident(rule_name)
+          rule_count += 1
+        if rsp_in:
+          writer.rule(rule_name, command, deps=deps, rspfile='$rspfile',
+            rspfile_content='$in')
+        else:
+          writer.rule(rule_name, command, deps=deps)
+        rules[key] = rule_name
+
+      # The depfile and response file differ for every build, thus they
+      # are set as variables of the build statement instead of the rule.
+      # So is the pool, which can be set for every call to build().
+      escape = creator.ninja.escape
+      pool = entry.get('pool') or self.pool
+      if pool:
+        variables = dict(variables or {})
+        variables['pool'] = pool
+      if entry.get('depfile'):
+        variables = dict(variables or {})
+        variables['depfile'] = escape(entry['depfile'])
+      if entry.get('rspfile'):
+        variables = dict(variables or {})
+        variables['rspfile'] = escape(entry['rspfile'])
+        if not rsp_in:
+          variables['rspfile_content'] = escape(entry['rspfile_content'])
 
       assert len(entry['outputs']) != 0
-      inputs = list(entry['inputs']) + infiles + entry['auxiliary']
-      writer.build(entry['outputs'], rule_name, inputs)
+      implicit = infiles + entry['auxiliary']
+      writer.build(entry['outputs'], rule_name, entry['inputs'], implicit,
+        variables=variables)
 
       writer.newline()
       phonies.extend(entry['outputs'])
@@ -764,7 +1188,9 @@ class Target(object):
 
 class Task(object):
   """
-  Represents a task-target that is run from Python.
+  Represents a task-target that is run from Python. If *func* is None,
+  the task has been restored from a snapshot and the function is
+  re-linked with :meth:`Unit.relink` when it is accessed.
   """
 
   def __init__(self, unit, name, func):
@@ -772,12 +1198,13 @@ class Task(object):
       raise TypeError('unit must be Unit', type(unit))
     if not isinstance(name, str):
       raise TypeError('name must be str', type(name))
-    if not callable(func):
-      raise TypeError('func must be callable', type(func))
+    if func is not None and not callable(func):
+      raise TypeError('func must be None or callable', type(func))
     super().__init__()
     self._unit = weakref.ref(unit)
     self._name = name
     self._func = func
+    self._requires = []
 
   @property
   def name(self):
@@ -789,6 +1216,10 @@ class Task(object):
 
   @property
   def func(self):
+    if self._func is None:
+      self.unit.relink()
+      if self._func is None:
+        raise RuntimeError('task could not be re-linked', self.identifier)
     return self._func
 
   @property
@@ -799,21 +1230,68 @@ class Task(object):
   def workspace(self):
     return self.unit.workspace
 
+  @property
+  def dependencies(self):
+    """
+    The :class:`Target` and :class:`Task` objects that must be built
+    and run before this task.
+    """
+
+    return [self._resolve(x) for x in self._requires]
+
+  def requires(self, target):
+    """
+    Adds *target* as a dependency for this task. Other than with
+    :meth:`Target.requires`, names are resolved when the dependencies
+    are requested, thus the *target* does not need to exist yet.
+
+    Args:
+      target (str, Target or Task): The target to build or the task to
+        run before this task. Names without a namespace are resolved in
+        the unit of the task.
+    """
+
+    if not isinstance(target, (str, Target, Task)):
+      raise TypeError('target must be str, Target or Task', type(target))
+    self._requires.append(target)
+
+  def _resolve(self, target):
+    """
+    Private. Resolves a dependency name passed to :meth:`requires`.
+    """
+
+    if isinstance(target, str):
+      target = self.unit.get_target(target)
+    if isinstance(target, Target) and not target.is_setup:
+      target.do_setup()
+    return target
+
 
 class WorkspaceContext(creator.macro.MutableContext):
   """
   This class implements the :class:`creator.macro.ContextProvider`
   interface for the global macro context of a :class:`Workspace`.
+
+  Attributes:
+    environ (dict of str -> str): The environment variables that have
+      been looked up as macros, mapped to their value or None if the
+      variable did not exist.
   """
 
   def __init__(self, workspace):
     super().__init__()
     self._workspace = weakref.ref(workspace)
+    self._namespaces = {}
+    self.environ = {}
     self['Platform'] = creator.macro.TextNode(creator.platform.platform_name)
     self['PlatformStandard'] = creator.macro.TextNode(
       creator.platform.platform_standard)
     self['Architecture'] = creator.macro.TextNode(
       creator.platform.architecture)
+    self['RspThreshold'] = creator.macro.TextNode(
+      str(creator.platform.rsp_threshold))
+    for name, depth in creator.platform.default_pool_depths().items():
+      self['pool.' + name] = creator.macro.TextNode(str(depth))
 
   @property
   def workspace(self):
@@ -830,25 +1308,57 @@ class WorkspaceContext(creator.macro.MutableContext):
     macro = super().get_macro(name, None)
     if macro is not None:
       return macro
-    if not name.startswith('_') and hasattr(creator.macro.Globals, name):
-      return getattr(creator.macro.Globals, name)
-    if name in os.environ:
-      return creator.macro.TextNode(os.environ[name])
+    macro = creator.macro.Globals.functions.get(name)
+    if macro is not None:
+      return macro
+    value = self.environ[name] = os.environ.get(name)
+    if value is not None:
+      return creator.macro.TextNode(value)
     raise KeyError(name)
 
   def get_namespace(self):
     return ''
 
+  def changed(self, name):
+    super().changed(name)
+    # Index the macro by every namespace its name could start with.
+    index = name.find(':')
+    while index >= 0:
+      self._namespaces.setdefault(name[:index], {})[name] = None
+      index = name.find(':', index + 1)
+
+  def namespace_macros(self, namespace):
+    """
+    Args:
+      namespace (str): The name of a namespace, eg. a unit identifier.
+    Returns:
+      list of str: The names of the macros that start with the
+        *namespace* followed by a colon, in the order they were
+        defined first.
+    """
+
+    names = self._namespaces.get(namespace, ())
+    return [name for name in names if name in self.macros]
+
 
 class UnitContext(creator.macro.ContextProvider):
   """
   This class implements the :class:`creator.macro.ContextProvider`
   interface for the local macro context of a :class:`Unit`.
+
+  Attributes:
+    versions (dict of None -> int): The number of times the aliases or
+      the identifier of the unit changed, under the key None. Macro
+      lookups are recorded with this version in an active
+      :class:`creator.macro.EvalSession`, since the names they resolve
+      to depend on it.
   """
 
   def __init__(self, unit):
     super().__init__()
     self._unit = weakref.ref(unit)
+    self._names = {}
+    self.versions = {}
     self['self'] = creator.macro.TextNode(self.unit.identifier)
     self['ProjectPath'] = creator.macro.TextNode(unit.project_path)
 
@@ -872,8 +1382,31 @@ class UnitContext(creator.macro.ContextProvider):
       namespace = None
     return creator.utils.create_var(namespace, varname)
 
+  def _resolve_name(self, name):
+    """
+    Private. Like :meth:`_prepare_name`, but caches the result. The
+    cache must be cleared with :meth:`names_changed` when the aliases
+    or the identifier of the unit change.
+    """
+
+    try:
+      return self._names[name]
+    except KeyError:
+      full_name = self._names[name] = self._prepare_name(name)
+      return full_name
+
+  def names_changed(self):
+    """
+    Clears the cache of resolved macro names and increments the
+    version in :attr:`versions`. Called when the aliases or the
+    identifier of the unit change.
+    """
+
+    self._names.clear()
+    self.versions[None] = self.versions.get(None, 0) + 1
+
   def __getitem__(self, name):
-    name = self._prepare_name(name)
+    name = self._resolve_name(name)
     return self.workspace.context[name]
 
   def __setitem__(self, name, value):
@@ -881,36 +1414,56 @@ class UnitContext(creator.macro.ContextProvider):
       value = creator.macro.parse(value, self)
     if not isinstance(value, creator.macro.ExpressionNode):
       raise TypeError('value must be str or ExpressionNode', type(value))
-    name = self._prepare_name(name)
+    name = self._resolve_name(name)
     self.workspace.context[name] = value
 
+  def append(self, name, value):
+    if isinstance(value, str):
+      value = creator.macro.parse_appendix(value, self)
+    if not isinstance(value, creator.macro.ExpressionNode):
+      raise TypeError('value must be str or ExpressionNode', type(value))
+    name = self._resolve_name(name)
+    self.workspace.context.append(name, value)
+
   def items(self):
-    namespace = creator.utils.create_var(self.unit.identifier, '')
-    for key, value in self.workspace.context.macros.items():
-      if key.startswith(namespace):
-        key = key[len(namespace):]
-        yield (key, value)
+    context = self.workspace.context
+    prefix_length = len(self.unit.identifier) + 1
+    for key in context.namespace_macros(self.unit.identifier):
+      yield (key[prefix_length:], context.macros[key])
 
   def update(self, mapping, context_switch=False):
     for key, value in list(mapping.items()):
       if context_switch and isinstance(value, creator.macro.ExpressionNode):
-        value = value.copy(self)
+        value = creator.macro.switch_context(value, self)
       self[key] = value
 
   def has_macro(self, name):
-    if self.workspace.context.has_macro(self._prepare_name(name)):
-      return True
-    return self.workspace.context.has_macro(name)
+    try:
+      self.get_macro(name)
+    except KeyError:
+      return False
+    return True
 
   def get_macro(self, name, default=NotImplemented):
+    # The macro of the unit is looked up in the macros of the workspace
+    # context only, the built-in functions and environment variables
+    # can only be found by the name that has been passed in.
+    context = self.workspace.context
+    session = creator.macro.EvalSession._local.current
+    if session is not None and session.depth:
+      session.reads.append((self, None, self.versions.get(None, 0)))
+    full_name = self._resolve_name(name)
+    if full_name != name:
+      macro = creator.macro.MutableContext.get_macro(context, full_name, None)
+      if macro is not None:
+        return macro
     try:
-      return self.workspace.context.get_macro(self._prepare_name(name))
+      return context.get_macro(name)
     except KeyError:
-      try:
-        return self.workspace.context.get_macro(name)
-      except KeyError:
-        pass
-    raise KeyError(name)
+      pass
+    if default is NotImplemented:
+      raise KeyError(name)
+    return default
 
   def get_namespace(self):
     return self.unit.identifier
@@ -19,11 +19,15 @@
 # THE SOFTWARE.
 
 import collections
+import hashlib
 import io
+import json
 import os
 import re
 import shlex
 import subprocess
+import tempfile
+import time
 
 try:
   import colorama
@@ -101,33 +105,278 @@ def normpath(x):
 def glob2(pattern):
   """
   Glob implementation using regex which supports double-wildcard
-  for recursive file pattern matching.
+  for recursive file pattern matching. Directory listings and results
+  are cached in the shared :data:`dir_index`.
   """
 
-  # Find the top-most directory that contains no patterns.
-  indices = [pattern.find('*'), pattern.find('?')]
-  indices = filter(lambda x: x >= 0, indices)
-  if not indices:
-    root = '.'
-  else:
-    root = os.path.dirname(pattern[:min(indices)]) or '.'
+  return dir_index.glob(pattern)
+
 
+def _glob_regex(pattern):
   pattern = re.escape(pattern)
   pattern = pattern.replace('\\*\\*', '.*?')
   pattern = pattern.replace('\\*', '[^/\\\\]*?')
   pattern = pattern.replace('\\?', '[^/\\\\]')
-  pattern = '^' + pattern + '$'
+  return re.compile('^' + pattern + '$', re.I)
+
+
+class DirectoryIndex(object):
+  """
+  An index of directory listings built with :func:`os.scandir` that
+  serves :func:`glob2`. Directories that can not match the literal path
+  segments of a pattern are not visited, and the results are memoized
+  per pattern until :meth:`clear` is called.
+
+  The modification time of every scanned directory is recorded. When
+  the index is loaded from a file with :meth:`load`, the listing of a
+  directory whose modification time did not change is reused instead
+  of being scanned again.
+
+  Attributes:
+    filename (str): The file the index is loaded from and saved to,
+      or None if the index is not persisted.
+    scans (int): The number of directories that have been scanned.
+    enabled (bool): If False, nothing is cached and every call to
+      :meth:`glob` scans the directories again. Disabled once files
+      may be created by the build, eg. while tasks run.
+  """
+
+  def __init__(self, filename=None):
+    super().__init__()
+    self.filename = filename
+    self.scans = 0
+    self.enabled = True
+    self._listings = {}
+    self._stored = {}
+    self._results = {}
+    self._dirty = False
+
+  def clear(self):
+    """
+    Forgets all listings and results of the current run. Listings that
+    have been loaded from a file are kept and validated again by their
+    modification time.
+    """
+
+    for dirname, (mtime, dirs, files, links) in self._listings.items():
+      self._stored[dirname] = (mtime, dirs, files, links)
+    self._listings.clear()
+    self._results.clear()
+
+  def load(self, filename=None):
+    """
+    Loads the directory listings from *filename* or :attr:`filename`.
+    Missing or corrupt files are ignored.
+    """
+
+    filename = filename or self.filename
+    try:
+      with open(filename) as fp:
+        data = json.load(fp)
+    except (OSError, ValueError):
+      return
+    if not isinstance(data, dict) or data.get('version') != 1:
+      return
+    for dirname, entry in data.get('dirs', {}).items():
+      mtime, dirs, files, links = entry
+      self._stored[dirname] = (mtime, dirs, files, links)
+
+  def save(self, filename=None):
+    """
+    Saves the directory listings to *filename* or :attr:`filename` if
+    anything has been scanned since the index was loaded. Listings of
+    directories that were modified less than two seconds before they
+    were scanned are not saved, as a later change could go unnoticed
+    with coarse timestamp resolutions.
+    """
+
+    filename = filename or self.filename
+    if not self._dirty or not filename:
+      return
+    dirs = dict(self._stored)
+    dirs.update(self._listings)
+    dirs = {k: v for k, v in dirs.items() if v[0] is not None and v[0] >= 0}
+    data = json.dumps({'version': 1, 'dirs': dirs})
+    write_atomic(filename, data.encode('utf8'))
+    self._dirty = False
+
+  def listdir(self, dirname):
+    """
+    Returns:
+      tuple of (list of str, list of str, list of str): The names of
+      the subdirectories, files and symbolic links to directories in
+      *dirname*. Symbolic links to directories are also contained in
+      the list of subdirectories, but they are not entered by
+      :meth:`glob`, just like with :func:`os.walk`.
+    """
+
+    if not self.enabled:
+      return self._scan(dirname)
+    listing = self._listings.get(dirname)
+    if listing is not None:
+      return listing[1:]
+
+    try:
+      mtime = os.stat(dirname).st_mtime_ns
+    except OSError:
+      self._listings[dirname] = (-1, [], [], [])
+      return ([], [], [])
+
+    listing = self._stored.pop(dirname, None)
+    if listing is None or listing[0] != mtime:
+      dirs, files, links = self._scan(dirname)
+      self._dirty = True
+      if time.time_ns() - mtime < 2 * 10 ** 9:
+        mtime = None
+      listing = (mtime, dirs, files, links)
+
+    self._listings[dirname] = listing
+    return listing[1:]
+
+  def _scan(self, dirname):
+    """
+    Private. Lists *dirname* like :meth:`listdir` without the cache.
+    """
+
+    dirs, files, links = [], [], []
+    try:
+      with os.scandir(dirname) as entries:
+        for entry in entries:
+          try:
+            is_dir = entry.is_dir()
+          except OSError:
+            is_dir = False
+          if is_dir:
+            dirs.append(entry.name)
+            if entry.is_symlink():
+              links.append(entry.name)
+          else:
+            files.append(entry.name)
+    except OSError:
+      pass
+    self.scans += 1
+    return (dirs, files, links)
+
+  def mtimes(self):
+    """
+    Returns:
+      dict of str -> int: The directories that have been listed since
+      the index was last cleared, mapped to their modification time in
+      nanoseconds. The time is -1 if the directory does not exist and
+      None if it was modified too recently to rely on it.
+    """
+
+    return {k: v[0] for k, v in self._listings.items()}
+
+  def listings(self):
+    """
+    Returns:
+      dict of str -> tuple: The directories that have been listed since
+      the index was last cleared, mapped to the modification time like
+      in :meth:`mtimes` and the names returned by :meth:`listdir`.
+    """
+
+    return dict(self._listings)
+
+  def glob(self, pattern):
+    """
+    Returns a list of the files that match *pattern*, see :func:`glob2`.
+    """
+
+    if not self.enabled:
+      return self._glob(pattern)
+    results = self._results.get(pattern)
+    if results is None:
+      results = self._results[pattern] = self._glob(pattern)
+    return list(results)
+
+  def _glob(self, pattern):
+    # Find the top-most directory that contains no patterns.
+    indices = [pattern.find('*'), pattern.find('?')]
+    indices = [x for x in indices if x >= 0]
+    if not indices:
+      dirs, files, links = self.listdir(os.path.dirname(pattern) or os.curdir)
+      return [pattern] if os.path.basename(pattern) in files else []
+    root = os.path.dirname(pattern[:min(indices)])
+
+    # Compile a regex for every path segment below the root up to the
+    # first one with a double-wildcard. Directories that don't match
+    # these segments can not contain any matches.
+    regex = _glob_regex(pattern)
+    segments = re.split(r'[/\\]', pattern[len(root):].lstrip('/\\'))
+    recursive = False
+    for index, segment in enumerate(segments):
+      if '**' in segment:
+        recursive = True
+        del segments[index:]
+        break
+      segments[index] = _glob_regex(segment)
+
+    results = []
+    stack = [(root, 0)]
+    while stack:
+      dirname, depth = stack.pop()
+      dirs, files, links = self.listdir(dirname or os.curdir)
+      if recursive or depth == len(segments) - 1:
+        for filename in files:
+          filename = os.path.join(dirname, filename)
+          if regex.match(filename):
+            results.append(filename)
+      if recursive or depth < len(segments) - 1:
+        for name in reversed(dirs):
+          if name in links:
+            continue
+          if depth < len(segments) and not segments[depth].match(name):
+            continue
+          stack.append((os.path.join(dirname, name), depth + 1))
+    return results
+
+
+#: The :class:`DirectoryIndex` that is used by :func:`glob2`.
+dir_index = DirectoryIndex()
+
+
+def write_atomic(filename, data):
+  """
+  Writes the bytes *data* to *filename* by writing a temporary file
+  first and replacing *filename* with it, thus readers will never see a
+  partially written file. Missing parent directories are created.
+  """
 
-  regex = re.compile(pattern, re.I)
-  results = []
-  if os.path.isdir(root):
-    for dirname, dirs, files in os.walk(root):
-      for filename in files:
-        filename = os.path.join(dirname, filename)
-        if regex.match(filename):
-          results.append(filename)
+  dirname = os.path.dirname(filename)
+  if dirname and not os.path.isdir(dirname):
+    os.makedirs(dirname)
+  fd, temp = tempfile.mkstemp(dir=dirname or os.curdir, suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as fp:
+      fp.write(data)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temp, 0o666 & ~umask)
+    os.replace(temp, filename)
+  except BaseException:
+    os.remove(temp)
+    raise
+
+
+def write_if_changed(filename, content):
+  """
+  Writes the string *content* to *filename* with :func:`write_atomic`
+  unless the file already has the same content.
+
+  Returns:
+    bool: True if the file was written, False if it was unchanged.
+  """
 
-  return results
+  data = content.encode('utf8')
+  try:
+    with open(filename, 'rb') as fp:
+      if hashlib.sha1(fp.read()).digest() == hashlib.sha1(data).digest():
+        return False
+  except OSError:
+    pass
+  write_atomic(filename, data)
+  return True
 
 
 def quote(s):
@@ -220,24 +469,76 @@ def split(text):
     list of str: The resulting list.
   """
 
-  items = []
-  while text:
-    index = text.find(';')
-    while index > 0 and (index - 1) == text.find('\\;', index - 1):
-      index = text.find(';', index + 1)
-
-    if index < 0:
-      item = text
-      text = None
-    else:
-      item = text[:index]
-      text = text[index + 1:]
+  if not text:
+    return []
+  parts = text.split(';')
+  if '\\' not in text:
+    return [item for item in parts if item]
 
-    if item:
-      items.append(item.replace('\\;', ';'))
+  # Glue parts back together that were separated by an escaped semicolon.
+  items = []
+  pending = []
+  for part in parts:
+    if part.endswith('\\'):
+      pending.append(part[:-1])
+      continue
+    if pending:
+      pending.append(part)
+      part = ';'.join(pending)
+      pending = []
+    if part:
+      items.append(part)
+  if pending:
+    items.append(';'.join(pending) + '\\')
   return items
 
 
+def iter_split(text):
+  """
+  Like :func:`split`, but returns a generator that yields the items one
+  by one, thus the list of items is never held in memory at once. The
+  text is scanned with :meth:`str.find` in linear time.
+
+  Args:
+    text (str): The text to split.
+  Returns:
+    iterator of str: The items in the text.
+  """
+
+  if not text:
+    return
+  find = text.find
+  start = 0
+  if '\\' not in text:
+    index = find(';')
+    while index >= 0:
+      if index > start:
+        yield text[start:index]
+      start = index + 1
+      index = find(';', start)
+    if start < len(text):
+      yield text[start:]
+    return
+
+  # Glue parts back together that were separated by an escaped semicolon.
+  pending = []
+  while start >= 0:
+    index = find(';', start)
+    part = text[start:] if index < 0 else text[start:index]
+    start = index if index < 0 else index + 1
+    if part.endswith('\\'):
+      pending.append(part[:-1])
+      continue
+    if pending:
+      pending.append(part)
+      part = ';'.join(pending)
+      pending = []
+    if part:
+      yield part
+  if pending:
+    yield ';'.join(pending) + '\\'
+
+
 def join(items):
   """
   Joins a list of strings into a single string by putting semicolons
@@ -250,7 +551,14 @@ def join(items):
     str: The semicolon separated list of the specified *items*.
   """
 
-  return ';'.join(item.replace(';', '\\;') for item in items if item)
+  items = [item for item in items if item]
+  text = ';'.join(items)
+
+  # If there are no more semicolons than separators, none of the
+  # items needs to be escaped.
+  if not items or text.count(';') == len(items) - 1:
+    return text
+  return ';'.join(item.replace(';', '\\;') for item in items)
 
 
 class Response(object):
@@ -0,0 +1,171 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.macro
+import creator.unit
+
+
+def dump(node):
+  """
+  Returns a nested tuple representation of the expression tree *node*
+  that can be compared between parsers.
+  """
+
+  if isinstance(node, creator.macro.TextNode):
+    return node.text
+  elif isinstance(node, creator.macro.ConcatNode):
+    return ('concat', [dump(child) for child in node.nodes])
+  elif isinstance(node, creator.macro.VarNode):
+    return ('var', node.varname, [dump(arg) for arg in node.args])
+  raise TypeError('unexpected node', type(node))
+
+
+class ParserTest(unittest.TestCase):
+
+  TEXTS = [
+    '', 'plain text', 'a, b', 'a$$b', '\\$a', '$', '$(', '$(unclosed',
+    '$a', '${a}', '$(a)', '${a b}', '$ns:var-x', '$"foo', '$<', '$@.d',
+    '$0 $1', '$!{list}', '$*{src/*.c}', '$(a b, c)', 'x$(f  a ,b )y',
+    '$(f a\\,b)', '$(f (a) b)', '$(a $(b $c), ${d})',
+    '$(quote $<) -o $(quote $@)',
+  ]
+
+  def test_tokenizer_matches_scanner_parser(self):
+    parser = creator.macro.Parser(cache_size=0)
+    reference = creator.macro.ScannerParser(cache_size=0)
+    for text in self.TEXTS:
+      with self.subTest(text=text):
+        self.assertEqual(
+          dump(parser.parse(text, None)), dump(reference.parse(text, None)))
+
+  def test_cache_reuses_trees(self):
+    parser = creator.macro.Parser()
+    context = creator.macro.MutableContext()
+    node = parser.parse('$a $(b c)', context)
+    self.assertIs(parser.parse('$a $(b c)', context), node)
+    self.assertEqual((parser.cache_hits, parser.cache_misses), (1, 1))
+
+    # The tree is bound to the context, another context misses.
+    other = creator.macro.MutableContext()
+    self.assertIsNot(parser.parse('$a $(b c)', other), node)
+    self.assertIsNot(parser.parse('$a $(b c)', None), node)
+    self.assertEqual((parser.cache_hits, parser.cache_misses), (1, 3))
+
+    parser.clear_cache()
+    self.assertEqual((parser.cache_hits, parser.cache_misses), (0, 0))
+    self.assertIsNot(parser.parse('$a $(b c)', context), node)
+
+  def test_cache_evicts_least_recently_used(self):
+    parser = creator.macro.Parser(cache_size=2)
+    a = parser.parse('$a', None)
+    b = parser.parse('$b', None)
+    self.assertIs(parser.parse('$a', None), a)
+    parser.parse('$c', None)
+    self.assertIs(parser.parse('$a', None), a)
+    self.assertIsNot(parser.parse('$b', None), b)
+
+  def test_cache_disabled(self):
+    parser = creator.macro.Parser(cache_size=0)
+    self.assertIsNot(parser.parse('$a', None), parser.parse('$a', None))
+    self.assertEqual((parser.cache_hits, parser.cache_misses), (0, 2))
+
+
+class EvalSessionTest(unittest.TestCase):
+
+  def setUp(self):
+    self.context = creator.unit.Workspace().context
+
+  def test_rsp_value_is_not_reused(self):
+    # A value that was evaluated without a response file must not be
+    # reused while one is active (and vice versa).
+    self.context['Objects'] = 'a.o b.o c.o d.o e.o f.o'
+    self.context['LinkArgs'] = '$(rsp $Objects)'
+    node = creator.macro.parse('$LinkArgs', self.context)
+
+    with creator.macro.EvalSession():
+      self.assertEqual(node.eval(self.context, []), 'a.o b.o c.o d.o e.o f.o')
+    with creator.macro.EvalSession():
+      with creator.macro.ResponseFile('link.rsp', 10) as rspfile:
+        self.assertEqual(node.eval(self.context, []), '@link.rsp')
+    self.assertEqual(rspfile.content, ['a.o b.o c.o d.o e.o f.o'])
+    with creator.macro.EvalSession():
+      self.assertEqual(node.eval(self.context, []), 'a.o b.o c.o d.o e.o f.o')
+
+
+  def test_reads_are_not_kept(self):
+    # A session that is shared by many evaluations must not accumulate
+    # the reads of the values it cached.
+    self.context['BuildDir'] = '$ProjectPath/build'
+    self.context['ProjectPath'] = '/project'
+    node = creator.macro.parse('-o $BuildDir/$@', self.context)
+    with creator.macro.EvalSession(watch=('@',)) as session:
+      for name in ('a.o', 'b.o', 'c.o'):
+        self.context['@'] = creator.macro.TextNode(name)
+        self.assertEqual(node.eval(self.context, []), '-o /project/build/' + name)
+    self.assertEqual(session.reads, [])
+    self.assertEqual(session.depth, 0)
+
+  def test_function_value_is_not_reused(self):
+    # Functions are impure unless declared otherwise.
+    calls = []
+    def counter(context, args):
+      calls.append(None)
+      return str(len(calls))
+    self.context['counter'] = creator.macro.Function(counter)
+    self.context['Count'] = 'n$(counter x)'
+    node = creator.macro.parse('$Count', self.context)
+    for expected in ('n1', 'n2'):
+      with creator.macro.EvalSession():
+        self.assertEqual(node.eval(self.context, []), expected)
+
+  def test_alias_change_invalidates_value(self):
+    # The value of $Cmd must not be reused after the alias that it
+    # reads through points to another unit.
+    tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempdir)
+    scripts = {
+      'a': "define('cpp', 'a-cpp')",
+      'b': "define('cpp', 'b-cpp')",
+      'main': "load('a', 'c')\n"
+        "define('Cmd', '$c:cpp -x')\n"
+        "first = eval('$Cmd')\n"
+        "load('b', 'c')\n"
+        "second = eval('$Cmd')\n",
+    }
+    for name, script in scripts.items():
+      with open(os.path.join(tempdir, name + '.crunit'), 'w') as fp:
+        fp.write(script)
+
+    workspace = creator.unit.Workspace()
+    workspace.path.insert(0, tempdir)
+    unit = workspace.load_unit('main')
+    self.assertEqual(unit.scope['first'], 'a-cpp -x')
+    self.assertEqual(unit.scope['second'], 'b-cpp -x')
+
+
+if __name__ == '__main__':
+  unittest.main()
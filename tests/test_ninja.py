@@ -0,0 +1,249 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.ninja
+import creator.unit
+
+
+class ExportTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tempdir)
+    self.workspace = creator.unit.Workspace()
+    self.workspace.path.insert(0, self.tempdir)
+
+  def load(self, identifier, script):
+    """
+    Writes *script* to the unit script *identifier* and loads it.
+    """
+
+    filename = os.path.join(self.tempdir, identifier + '.crunit')
+    with open(filename, 'w') as fp:
+      fp.write(script)
+    return self.workspace.load_unit(identifier)
+
+  def export(self, unit, **kwargs):
+    """
+    Sets up the targets and returns the exported build definitions.
+    """
+
+    self.workspace.setup_targets()
+    fp = io.StringIO()
+    creator.ninja.export(fp, self.workspace, unit, **kwargs)
+    return fp.getvalue()
+
+  def test_subninja_static_unit(self):
+    # The identifiers of static units contain characters that can not
+    # be used in a file name.
+    unit = self.load('main',
+      "@target\n"
+      "def obj():\n"
+      "  obj.build('a.c', 'a.o', 'cc -c $< -o $@')\n")
+    filename = os.path.join(self.tempdir, 'profile')
+    with open(filename, 'w') as fp:
+      fp.write(
+        "@target\n"
+        "def gen():\n"
+        "  gen.build('b.c', 'b.o', 'cc -c $< -o $@')\n")
+    static = creator.unit.Unit(self.tempdir, 'static|' + filename, self.workspace)
+    self.workspace.units[static.identifier] = static
+    static.run_unit_script(filename)
+
+    subninja_dir = os.path.join(self.tempdir, 'build.ninja.d')
+    self.export(unit, subninja_dir=subninja_dir)
+    names = sorted(os.listdir(subninja_dir))
+    self.assertEqual(len(names), 2)
+    self.assertIn('main.ninja', names)
+    static_name = creator.ninja.unit_filename(static.identifier, '.ninja')
+    self.assertIn(static_name, names)
+    self.assertNotIn('|', static_name)
+    self.assertNotIn(os.sep, static_name)
+    with open(os.path.join(subninja_dir, static_name)) as fp:
+      self.assertIn('b.o', fp.read())
+
+
+  def test_build_each_shares_rule(self):
+    unit = self.load('main',
+      "@target\n"
+      "def objects():\n"
+      "  objects.build_each('a.c;b.c;c d.c', 'a.o;b.o;c d.o',\n"
+      "    'cc -c $< -o $@ -MF ${@}.d')\n")
+    output = self.export(unit)
+    entries = unit.targets['objects'].command_data
+    self.assertEqual(entries[0]['template'],
+      'cc -c {0} -o {1} -MF {1}.d'.format(
+        creator.ninja.IN_PLACEHOLDER, creator.ninja.OUT_PLACEHOLDER))
+    self.assertEqual(entries[1]['template'], entries[0]['template'])
+
+    # Paths that ninja would quote in $in and $out can not use the rule.
+    self.assertIsNone(entries[2]['template'])
+    self.assertEqual(output.count('rule main_objects_'), 1)
+    self.assertIn('command = cc -c $in -o $out -MF $out.d\n', output)
+    self.assertEqual(output.count(': main_objects_0000 '), 2)
+
+  def test_dependency_phony_is_implicit_input(self):
+    unit = self.load('main',
+      "@target\n"
+      "def objects():\n"
+      "  objects.build_each('a.c;b.c', 'a.o;b.o', 'cc -c $< -o $@')\n"
+      "@target\n"
+      "def nothing():\n"
+      "  pass\n"
+      "@target\n"
+      "def lib():\n"
+      "  lib.requires(objects)\n"
+      "  lib.requires(nothing)\n"
+      "  lib.build('lib.c', 'lib.o', 'cc -c $< -o $@')\n")
+    output = self.export(unit)
+    lines = [x for x in output.splitlines() if x.startswith('build ')]
+    lib_line = next(x for x in lines if 'lib.o' in x)
+
+    # Targets without outputs have no phony target to depend on.
+    self.assertTrue(lib_line.endswith(' | main_objects'), lib_line)
+    self.assertNotIn('a.o', lib_line)
+    self.assertIn('build main_objects: phony ', output)
+
+  def test_depfile_and_deps(self):
+    unit = self.load('main',
+      "@target\n"
+      "def objects():\n"
+      "  objects.build_each('a.c;b.c', 'a.o;b.o', 'cc -c $< -o $@ -MF ${@}.d',\n"
+      "    depfile='${@}.d', deps='gcc')\n"
+      "@target\n"
+      "def lib():\n"
+      "  lib.build('a.o;b.o', 'lib.a', 'ar rcs $@ $(quotesplit $<)',\n"
+      "    depfile='${@}.d', deps='$NoDeps')\n")
+    output = self.export(unit)
+    entries = unit.targets['objects'].command_data
+    self.assertEqual([x['depfile'] for x in entries],
+      [os.path.abspath('a.o.d'), os.path.abspath('b.o.d')])
+    self.assertEqual([x['deps'] for x in entries], ['gcc', 'gcc'])
+
+    # The depfile is a variable of every build, deps one of the rule.
+    self.assertIn('rule main_objects_0000\n'
+      '  command = cc -c $in -o $out -MF $out.d\n  deps = gcc\n', output)
+    for entry in entries:
+      self.assertIn('  depfile = {0}\n'.format(entry['depfile']), output)
+
+    # Deps that evaluate to nothing are left out.
+    entry = unit.targets['lib'].command_data[0]
+    self.assertIsNone(entry['deps'])
+    self.assertEqual(entry['depfile'], os.path.abspath('lib.a.d'))
+    self.assertIn('rule creator_command\n  command = $command\n', output)
+
+  RSP_SCRIPT = (
+    "@target\n"
+    "def lib():\n"
+    "  lib.build('a.o;b.o;c.o', 'lib.a', 'ar rcs $@ $(rsp $(quotesplit $<))')\n"
+    "@target\n"
+    "def objects():\n"
+    "  objects.build_each('a.c;b.c', 'a.o;b.o', 'cc $(rsp -DVERSION=1) -c $<')\n")
+
+  def test_rsp_threshold_unset(self):
+    # Without a threshold, the text is always kept in the command.
+    self.workspace.context['RspThreshold'] = ''
+    unit = self.load('main', self.RSP_SCRIPT)
+    self.export(unit)
+    inputs = ' '.join(map(os.path.abspath, ['a.o', 'b.o', 'c.o']))
+    entry = unit.targets['lib'].command_data[0]
+    self.assertEqual(entry['command'],
+      'ar rcs {0} {1}'.format(os.path.abspath('lib.a'), inputs))
+    self.assertIsNone(entry['rspfile'])
+    self.assertIsNone(entry['rspfile_content'])
+
+  def test_rsp_threshold(self):
+    self.workspace.context['RspThreshold'] = '20'
+    unit = self.load('main', self.RSP_SCRIPT)
+    output = self.export(unit)
+
+    # Text longer than the threshold is moved to the response file. If it
+    # is just the inputs, the rule writes $in to the response file.
+    inputs = ' '.join(map(os.path.abspath, ['a.o', 'b.o', 'c.o']))
+    rspfile = os.path.abspath('lib.a.rsp')
+    entry = unit.targets['lib'].command_data[0]
+    self.assertEqual(entry['command'],
+      'ar rcs {0} @{1}'.format(os.path.abspath('lib.a'), rspfile))
+    self.assertEqual(entry['rspfile'], rspfile)
+    self.assertEqual(entry['rspfile_content'], inputs)
+    self.assertIn('  rspfile = $rspfile\n  rspfile_content = $in\n', output)
+    self.assertIn('  rspfile = {0}\n'.format(rspfile), output)
+
+    # Shorter text stays in the command.
+    entries = unit.targets['objects'].command_data
+    self.assertEqual([x['rspfile'] for x in entries], [None, None])
+    self.assertEqual(entries[0]['template'],
+      'cc -DVERSION=1 -c ' + creator.ninja.IN_PLACEHOLDER)
+
+  def test_compdb_fragments(self):
+    # The scripts are written before any unit is loaded, see find_unit().
+    for name in ('a', 'b'):
+      with open(os.path.join(self.tempdir, name + '.crunit'), 'w') as fp:
+        fp.write(
+          "@target\n"
+          "def objects():\n"
+          "  objects.build_each('{0}1.c;{0}2.cpp', '{0}1.o;{0}2.o',\n"
+          "    'cc -c $< -o $@')\n"
+          "@target\n"
+          "def lib():\n"
+          "  lib.build('{0}1.o;{0}2.o', '{0}.a', 'ar rcs $@ $(quotesplit $<)')\n"
+          .format(name))
+    units = [self.workspace.load_unit(name) for name in ('a', 'b')]
+    self.workspace.setup_targets()
+    filename = os.path.join(self.tempdir, 'compile_commands.json')
+    fragment_dir = filename + '.d'
+
+    def read(filename):
+      with open(filename) as fp:
+        return json.load(fp)
+
+    creator.ninja.export_compdb(filename, units, fragment_dir)
+    self.assertEqual(sorted(os.listdir(fragment_dir)), ['a.json', 'b.json'])
+    database = read(filename)
+    self.assertEqual([os.path.basename(x['file']) for x in database],
+      ['a1.c', 'a2.cpp', 'b1.c', 'b2.cpp'])
+    self.assertEqual(database[0]['command'], 'cc -c {0} -o {1}'.format(
+      database[0]['file'], database[0]['output']))
+    self.assertEqual(read(os.path.join(fragment_dir, 'a.json')), database[:2])
+
+    # The database is not written again if no fragment changed.
+    mtime = os.stat(filename).st_mtime_ns
+    with open(filename, 'w') as fp:
+      fp.write('[]\n')
+    os.utime(filename, ns=(mtime, mtime))
+    creator.ninja.export_compdb(filename, units, fragment_dir)
+    self.assertEqual(read(filename), [])
+
+    # Fragments of units that are no longer exported are removed.
+    creator.ninja.export_compdb(filename, units[:1], fragment_dir)
+    self.assertEqual(os.listdir(fragment_dir), ['a.json'])
+    self.assertEqual(read(filename), database[:2])
+
+if __name__ == '__main__':
+  unittest.main()
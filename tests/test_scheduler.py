@@ -0,0 +1,126 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.scheduler
+import creator.unit
+
+
+SCRIPT = """\
+import time
+
+order = []
+
+@target
+def obj():
+  obj.build('a.c', 'a.o', 'cc -c $< -o $@')
+
+@task
+def a():
+  time.sleep(0.05)
+  order.append('a')
+
+@task(requires=['a'])
+def b():
+  order.append('b')
+
+@task(requires=['a', 'b', 'obj'])
+def c():
+  order.append('c')
+
+@task
+def fail():
+  exit(3)
+
+@task(requires=['fail'])
+def after_fail():
+  order.append('after_fail')
+
+@task(requires=['obj'])
+def after_obj():
+  order.append('after_obj')
+
+@task(requires=['cycle2'])
+def cycle1():
+  pass
+
+@task(requires=['cycle1'])
+def cycle2():
+  pass
+"""
+
+#: Commands that are run instead of ninja, the targets are appended.
+NINJA_OK = [sys.executable, '-c', 'pass']
+NINJA_FAIL = [sys.executable, '-c', 'raise SystemExit(2)']
+
+
+class SchedulerTest(unittest.TestCase):
+
+  def setUp(self):
+    tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempdir)
+    with open(os.path.join(tempdir, 'main.crunit'), 'w') as fp:
+      fp.write(SCRIPT)
+    workspace = creator.unit.Workspace()
+    workspace.path.insert(0, tempdir)
+    self.unit = workspace.load_unit('main')
+    workspace.setup_targets()
+
+  def run_tasks(self, ninja_args, *names):
+    scheduler = creator.scheduler.Scheduler(ninja_args, 4, log=lambda x: None)
+    return scheduler.run([self.unit.targets[name] for name in names])
+
+  def test_expand(self):
+    targets = self.unit.targets
+    expanded = creator.scheduler.expand([targets['c'], targets['b']])
+    # Tasks requested explicitly are run again.
+    self.assertEqual([x.name for x in expanded], ['a', 'b', 'obj', 'c', 'b'])
+    with self.assertRaises(ValueError):
+      creator.scheduler.expand([targets['cycle1']])
+
+  def test_dependencies_run_first(self):
+    results = self.run_tasks(NINJA_OK, 'c')
+    self.assertEqual(self.unit.scope['order'], ['a', 'b', 'c'])
+    names = [x.name for x in results]
+    self.assertEqual(sorted(names), ['main:a', 'main:b', 'main:c', 'main_obj'])
+    self.assertLess(names.index('main_obj'), names.index('main:c'))
+    self.assertEqual([x.returncode for x in results], [0, 0, 0, 0])
+
+  def test_stop_after_failure(self):
+    results = self.run_tasks(NINJA_OK, 'fail', 'after_fail')
+    self.assertEqual(self.unit.scope['order'], [])
+    self.assertEqual([(x.name, x.returncode) for x in results],
+      [('main:fail', 3)])
+
+  def test_stop_after_ninja_failure(self):
+    results = self.run_tasks(NINJA_FAIL, 'after_obj', 'a')
+    self.assertNotIn('after_obj', self.unit.scope['order'])
+    self.assertIn(('ninja', 2), [(x.kind, x.returncode) for x in results])
+
+
+if __name__ == '__main__':
+  unittest.main()
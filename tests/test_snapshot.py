@@ -0,0 +1,104 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.snapshot
+import creator.unit
+
+
+SCRIPT = """\
+import os
+with open(os.path.join(os.path.dirname(__file__), 'runs'), 'a') as fp:
+  fp.write('x')
+
+@G.function
+def shout(context, args):
+  return ' '.join(n.eval(context, []) for n in args).upper()
+
+define('Greeting', '$(shout hello)')
+
+@target
+def obj():
+  obj.build('a.c', 'a.o', 'cc -c $< -o $@')
+
+@task(requires=['obj'])
+def hello():
+  return eval('$Greeting')
+"""
+
+
+class SnapshotTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tempdir)
+    with open(os.path.join(self.tempdir, 'main.crunit'), 'w') as fp:
+      fp.write(SCRIPT)
+    workspace = creator.unit.Workspace()
+    workspace.path.insert(0, self.tempdir)
+    self.unit = workspace.load_unit('main')
+    workspace.setup_targets()
+    self.filename = os.path.join(self.tempdir, 'snapshot')
+    self.assertTrue(creator.snapshot.save(self.filename, workspace, 'key'))
+
+  def runs(self):
+    with open(os.path.join(self.tempdir, 'runs')) as fp:
+      return len(fp.read())
+
+  def test_key_mismatch(self):
+    self.assertIsNone(creator.snapshot.load(self.filename, 'other'))
+    self.assertIsNone(creator.snapshot.load(self.filename + '.missing', 'key'))
+
+  def test_targets_are_restored(self):
+    workspace = creator.snapshot.load(self.filename, 'key')
+    unit = workspace.units['main']
+    self.assertEqual(unit.targets['obj'].command_data,
+      self.unit.targets['obj'].command_data)
+    task = unit.targets['hello']
+    self.assertEqual([x.identifier for x in task.dependencies], ['main:obj'])
+    self.assertEqual(self.runs(), 1)
+
+  def test_relink_function(self):
+    workspace = creator.snapshot.load(self.filename, 'key')
+    unit = workspace.units['main']
+    shout = workspace.context.macros['shout']
+    self.assertIsInstance(shout, creator.snapshot.LinkFunction)
+
+    # The unit script is run again once the function is called.
+    self.assertEqual(self.runs(), 1)
+    self.assertEqual(unit.eval('$Greeting'), 'HELLO')
+    self.assertEqual(self.runs(), 2)
+    self.assertEqual(unit.targets['hello'].func(), 'HELLO')
+    self.assertEqual(self.runs(), 2)
+
+    # The macros of the snapshot are kept.
+    self.assertIs(workspace.context.macros['shout'], shout)
+    self.assertEqual(list(unit.targets), ['obj', 'hello'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,131 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.unit
+
+
+class CompileUnitScriptTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tempdir)
+    self.cache_dir = os.path.join(self.tempdir, 'cache', 'units')
+    patcher = unittest.mock.patch.dict(os.environ,
+      {'CREATOR_CACHE_DIR': os.path.join(self.tempdir, 'cache')})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    # The cache honors PYTHONDONTWRITEBYTECODE like the import system.
+    patcher = unittest.mock.patch.object(sys, 'dont_write_bytecode', False)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.filename = os.path.join(self.tempdir, 'main.crunit')
+
+  def write(self, script, mtime):
+    with open(self.filename, 'w') as fp:
+      fp.write(script)
+    os.utime(self.filename, ns=(mtime, mtime))
+
+  def run_script(self):
+    scope = {}
+    exec(creator.unit.compile_unit_script(self.filename), scope)
+    return scope['value']
+
+  def test_cache_invalidation(self):
+    # Files modified just now are not cached, use a time in the past.
+    self.write('value = 1', 10 ** 18)
+    self.assertEqual(self.run_script(), 1)
+    self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    # The cached code is used while the time and size are unchanged.
+    self.write('value = 2', 10 ** 18)
+    self.assertEqual(self.run_script(), 1)
+
+    self.write('value = 2', 2 * 10 ** 18)
+    self.assertEqual(self.run_script(), 2)
+    self.write('value = 30', 2 * 10 ** 18)
+    self.assertEqual(self.run_script(), 30)
+
+  def test_recent_file_is_not_cached(self):
+    self.write('value = 1', time.time_ns())
+    self.assertEqual(self.run_script(), 1)
+    self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class FindUnitTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tempdir)
+    self.workspace = creator.unit.Workspace()
+
+  def touch(self, *parts):
+    filename = os.path.join(self.tempdir, *parts)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w'):
+      pass
+    return filename
+
+  def test_search_order(self):
+    first = self.touch('first', 'a.crunit')
+    self.touch('first', 'sub', 'a.crunit')
+    sub_b = self.touch('first', 'sub', 'b.crunit')
+    self.touch('first', 'sub', 'deep', 'c.crunit')
+    self.touch('second', 'a.crunit')
+    self.touch('second', 'b.crunit')
+    second_c = self.touch('second', 'c.crunit')
+    self.workspace.path[:0] = [
+      os.path.join(self.tempdir, 'first'), os.path.join(self.tempdir, 'second')]
+
+    find_unit = self.workspace.find_unit
+    self.assertEqual(find_unit('a'), first)
+    self.assertEqual(find_unit('b'), sub_b)
+    self.assertEqual(find_unit('c'), second_c)
+    with self.assertRaises(creator.unit.UnitNotFoundError):
+      find_unit('missing')
+
+  def test_index_is_built_lazily(self):
+    a = self.touch('first', 'a.crunit')
+    self.touch('second', 'b.crunit')
+    self.workspace.path[:] = [
+      os.path.join(self.tempdir, 'first'), os.path.join(self.tempdir, 'second')]
+    self.assertEqual(self.workspace.find_unit('a'), a)
+    self.assertEqual(self.workspace.unit_index.scans, 1)
+
+  def test_path_change_rebuilds_index(self):
+    self.touch('first', 'a.crunit')
+    second = self.touch('second', 'a.crunit')
+    self.workspace.path.insert(0, os.path.join(self.tempdir, 'first'))
+    self.workspace.find_unit('a')
+    self.workspace.path[0] = os.path.join(self.tempdir, 'second')
+    self.assertEqual(self.workspace.find_unit('a'), second)
+
+
+if __name__ == '__main__':
+  unittest.main()
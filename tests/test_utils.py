@@ -0,0 +1,157 @@
+# Copyright (C) 2015 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import creator.utils
+
+
+class SplitJoinTest(unittest.TestCase):
+
+  lists = [
+    [],
+    ['a'],
+    ['a', 'b', 'c'],
+    ['a;b', 'c'],
+    ['a;', ';b', ';'],
+    ['C:\\path\\file', 'x'],
+    ['/src/file{0}.c'.format(i) for i in range(1000)],
+  ]
+
+  def test_round_trip(self):
+    for items in self.lists:
+      text = creator.utils.join(items)
+      self.assertEqual(creator.utils.split(text), items)
+      self.assertEqual(list(creator.utils.iter_split(text)), items)
+
+  def test_join_escapes_separators(self):
+    self.assertEqual(creator.utils.join(['a;b', 'c']), 'a\\;b;c')
+    self.assertEqual(creator.utils.join(['a\\b;', 'c']), 'a\\b\\;;c')
+    self.assertEqual(creator.utils.split('a\\b\\;;c'), ['a\\b;', 'c'])
+
+  def test_split_skips_empty_items(self):
+    for text in ('', ';', ';;a;;b;', 'a\\;b;;c'):
+      expected = creator.utils.split(text)
+      self.assertNotIn('', expected)
+      self.assertEqual(list(creator.utils.iter_split(text)), expected)
+    self.assertEqual(creator.utils.split(';;a;;b;'), ['a', 'b'])
+    self.assertEqual(creator.utils.split('a\\;b;;c'), ['a;b', 'c'])
+
+
+def walk_glob(pattern):
+  """
+  The :func:`os.walk` based implementation of :func:`creator.utils.glob2`
+  that the :class:`creator.utils.DirectoryIndex` replaced.
+  """
+
+  indices = [x for x in (pattern.find('*'), pattern.find('?')) if x >= 0]
+  root = os.path.dirname(pattern[:min(indices, default=len(pattern))]) or '.'
+  regex = creator.utils._glob_regex(pattern)
+  results = []
+  for dirname, dirs, files in os.walk(root):
+    for filename in files:
+      filename = os.path.join(dirname, filename)
+      if regex.match(filename):
+        results.append(filename)
+  return results
+
+
+class DirectoryIndexTest(unittest.TestCase):
+
+  files = [
+    'main.c', 'main.h', 'README',
+    'src/a.c', 'src/a.h', 'src/b.c',
+    'src/sub/c.c', 'src/sub/deep/d.c',
+    'sac/x.c', 'include/a.h', 'include/sub/b.h',
+  ]
+
+  patterns = [
+    '*.c', '*.h', 'README', 'missing', 'src/*.c', 'src/*/*.c', '*/*.h',
+    's?c/*.c', '**.c', '**/*.h', 'src/**', 'src/**/*.c', 'include/**.h',
+    'nothing/*.c', 'nothing/**',
+  ]
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.root)
+    for name in self.files:
+      self.touch(name)
+
+  def touch(self, name):
+    filename = os.path.join(self.root, name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w'):
+      pass
+
+  def test_matches_walk_glob(self):
+    index = creator.utils.DirectoryIndex()
+    for pattern in self.patterns:
+      with self.subTest(pattern=pattern):
+        pattern = os.path.join(self.root, pattern)
+        self.assertEqual(sorted(index.glob(pattern)), sorted(walk_glob(pattern)))
+
+  def test_skips_unmatched_directories(self):
+    index = creator.utils.DirectoryIndex()
+    index.glob(os.path.join(self.root, 'src', '*.c'))
+    self.assertEqual(index.scans, 1)
+    index.glob(os.path.join(self.root, 's?c', '*.c'))
+    self.assertEqual(index.scans, 3)
+
+  def test_disabled_index_scans_again(self):
+    index = creator.utils.DirectoryIndex()
+    pattern = os.path.join(self.root, 'src', '*.c')
+    self.assertEqual(len(index.glob(pattern)), 2)
+    self.touch('src/new.c')
+    self.assertEqual(len(index.glob(pattern)), 2)
+    index.enabled = False
+    self.assertEqual(len(index.glob(pattern)), 3)
+
+  def test_load_reuses_unchanged_listings(self):
+    # Listings of recently modified directories are not saved.
+    for dirname, _, _ in os.walk(self.root):
+      os.utime(dirname, ns=(0, 10 ** 18))
+    cachedir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, cachedir)
+    filename = os.path.join(cachedir, 'index.json')
+    pattern = os.path.join(self.root, '**.c')
+    index = creator.utils.DirectoryIndex(filename)
+    expected = sorted(index.glob(pattern))
+    index.save()
+
+    index = creator.utils.DirectoryIndex(filename)
+    index.load()
+    self.assertEqual(sorted(index.glob(pattern)), expected)
+    self.assertEqual(index.scans, 0)
+
+    # A directory that has been modified is scanned again.
+    self.touch('src/new.c')
+    index = creator.utils.DirectoryIndex(filename)
+    index.load()
+    self.assertIn(os.path.join(self.root, 'src', 'new.c'), index.glob(pattern))
+    self.assertEqual(index.scans, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()